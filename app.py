@@ -1,27 +1,196 @@
-from flask import Flask, request, jsonify, render_template
+import startup
+startup.profile.start() # Times every import below, see /startup
+from flask import Flask, request, jsonify, render_template, Response, stream_with_context, g, send_file, url_for, abort, has_app_context
 import datetime
-import google.generativeai as genai
 import os
 from dotenv import load_dotenv
-from gtts import gTTS
-import io
-import base64
 import re
 import json
+import uuid
+import time
+from contextlib import nullcontext
+from history_store import SessionHistoryStore
+from context_window import ContextWindow
+from persona_registry import PersonaRegistry
+from tts_cache import TTSCache
+from pipeline import SpeechPipeline
+from upstream import Upstream, UpstreamError, retry_after_header
+from backends import create_backends
+from metrics import Metrics, Gauge
+from response_cache import ResponseCache
+from speech_text import SpeechText, to_speech
+from avatar_assets import AvatarAssets, DEFAULT_TIERS, build as build_avatar, report as avatar_report
+import click
 app = Flask(__name__)
 
 # --- Setup ---
 load_dotenv()
-GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
-if not GEMINI_API_KEY:
-    raise ValueError("GEMINI_API_KEY not found!")
-genai.configure(api_key=GEMINI_API_KEY)
+# LLM_BACKEND=gemini|fake, TTS_BACKEND=gtts|fake (see backends.py). Client
+# libraries are imported on first use or by warm_up() below, so importing the
+# app is cheap; a missing GEMINI_API_KEY is reported by validate_config().
+with startup.profile.phase('create_backends'):
+    llm_backend, tts_backend = create_backends()
+
+# --- Metrics ---
+# Per-stage timings for every request (Server-Timing header) and Prometheus
+# metrics at /metrics, see metrics.py. METRICS_SAMPLE_RATE < 1 only times a
+# fraction of requests; request and error counters are always kept.
+metrics = Metrics(
+    enabled=os.getenv('METRICS_ENABLED', 'true').lower() not in ('0', 'false', 'no'),
+    sample_rate=float(os.getenv('METRICS_SAMPLE_RATE', 1.0)),
+    server_timing=os.getenv('METRICS_SERVER_TIMING', 'true').lower() not in ('0', 'false', 'no'),
+)
+
+def current_request_metrics():
+    """The RequestMetrics of the current request (also inside pipeline threads), or None."""
+    return g.get('metrics') if has_app_context() else None
+
+def timed(stage):
+    """Times a stage of the current request; a no-op outside requests or when not sampled."""
+    request_metrics = current_request_metrics()
+    return request_metrics.stage(stage) if request_metrics else nullcontext()
+
+def record_metric(name, value):
+    request_metrics = current_request_metrics()
+    if request_metrics and request_metrics.sampled:
+        request_metrics.record(name, value)
+
+def timed_iter(iterable, stage):
+    """Like timed(), for the time spent waiting on each item of an iterator."""
+    request_metrics = current_request_metrics()
+    return request_metrics.iterate(iterable, stage) if request_metrics else iterable
+
+def set_metrics_character(character):
+    request_metrics = current_request_metrics()
+    if request_metrics:
+        request_metrics.character = character # Persona name, so label values stay bounded
+
+def count_error(kind):
+    request_metrics = current_request_metrics()
+    metrics.error(kind, request_metrics.endpoint if request_metrics else None)
+
+@app.before_request
+def start_request_metrics():
+    g.metrics = metrics.begin(request.endpoint)
+
+@app.after_request
+def finish_request_metrics(response):
+    request_metrics = g.get('metrics')
+    if request_metrics:
+        if request_metrics.sampled and metrics.server_timing:
+            response.headers['Server-Timing'] = request_metrics.server_timing()
+        # Runs once the body has been sent, so streamed responses are counted in full
+        response.call_on_close(lambda: metrics.finish(request_metrics, response.status_code))
+    return response
+
+# --- Upstream Services ---
+# Gemini and gTTS calls go through an Upstream guard (see upstream.py):
+# bounded concurrency, deadlines, retries with jittered backoff, a circuit
+# breaker, and 429/503 + Retry-After instead of unbounded queueing.
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+def error_status(error):
+    """HTTP status behind an upstream client error, or None."""
+    status = getattr(error, 'code', None) # google.api_core exceptions carry the HTTP status here
+    rsp = getattr(error, 'rsp', None) # gTTSError keeps the failed requests.Response
+    if rsp is not None:
+        status = rsp.status_code
+    return status if isinstance(status, int) else None
+
+def is_retryable_error(error):
+    """True for transient upstream failures (rate limits, 5xx, timeouts, dropped connections)."""
+    status = error_status(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    import requests # Deferred: the slowest import at worker boot, and only needed once a call fails
+    return isinstance(error, (requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError))
+
+def is_timeout_error(error):
+    """True for client-side and gateway timeouts (DeadlineExceeded, requests.Timeout, ...)."""
+    status = error_status(error)
+    if status is not None:
+        return status in (408, 504)
+    import requests
+    return isinstance(error, (requests.Timeout, TimeoutError))
+
+llm_upstream = Upstream(
+    'gemini',
+    max_concurrency=int(os.getenv('LLM_MAX_CONCURRENCY', 16)),
+    max_waiting=int(os.getenv('LLM_MAX_WAITING', 64)),
+    timeout=float(os.getenv('LLM_TIMEOUT', 30)),
+    retries=int(os.getenv('LLM_RETRIES', 2)),
+    is_retryable=is_retryable_error,
+    is_timeout=is_timeout_error,
+)
+tts_upstream = Upstream(
+    'gtts',
+    max_concurrency=int(os.getenv('TTS_MAX_CONCURRENCY', 8)),
+    max_waiting=int(os.getenv('TTS_MAX_WAITING', 64)),
+    timeout=float(os.getenv('TTS_TIMEOUT', 10)),
+    retries=int(os.getenv('TTS_RETRIES', 2)),
+    is_retryable=is_retryable_error,
+    is_timeout=is_timeout_error,
+)
+
+def upstream_error_response(error):
+    """JSON error for a rejected/timed-out upstream call, with Retry-After when known."""
+    print(f"Upstream rejected request: {error}")
+    count_error(type(error).__name__)
+    response = jsonify({
+        "response": "I'm a little overloaded right now. Please try again in a moment.",
+        "audio_url": None
+    })
+    response.status_code = error.status_code
+    if error.retry_after:
+        response.headers['Retry-After'] = retry_after_header(error.retry_after)
+    return response
+
+app.register_error_handler(UpstreamError, upstream_error_response)
+
+# --- Conversation History (per browser session) ---
+# Histories live in a SQLite file (WAL mode) shared by all gunicorn workers,
+# with a bounded in-memory LRU cache in front of it in each worker.
+SESSION_COOKIE = 'deva_session'
+history_store = SessionHistoryStore(
+    os.getenv('HISTORY_DB_PATH', os.path.join(app.instance_path, 'history.sqlite3')),
+    max_cached_sessions=int(os.getenv('HISTORY_MAX_CACHED_SESSIONS', 500)),
+    max_memory_bytes=int(os.getenv('HISTORY_MAX_MEMORY_BYTES', 32 * 1024 * 1024)),
+    max_session_turns=int(os.getenv('HISTORY_MAX_SESSION_TURNS', 100)),
+    max_session_bytes=int(os.getenv('HISTORY_MAX_SESSION_BYTES', 256 * 1024)),
+    idle_ttl=int(os.getenv('HISTORY_IDLE_TTL', 24 * 60 * 60)),
+)
+
+def get_session_id():
+    """Returns the caller's session id, creating one (sent as a cookie) if needed."""
+    if 'session_id' not in g:
+        session_id = request.cookies.get(SESSION_COOKIE, '')
+        if not re.fullmatch(r'[0-9a-f]{32}', session_id):
+            session_id = uuid.uuid4().hex
+        g.session_id = session_id
+    return g.session_id
+
+def get_conversation_history():
+    """List-like view of the caller's conversation history."""
+    return history_store.session(get_session_id())
+
+@app.after_request
+def set_session_cookie(response):
+    # Re-sent on every request that used the session, so the cookie's expiry
+    # slides with activity like the server-side idle TTL does
+    if 'session_id' in g:
+        response.set_cookie(SESSION_COOKIE, g.session_id, httponly=True, samesite='Lax',
+                            max_age=history_store.idle_ttl)
+    return response
+
+# --- Personas ---
+# System prompts and voice settings live in personas/<name>.txt + .json and are
+# loaded once. Each persona's model is created once and reused (built by
+# warm_up() before traffic, or on first use).
+persona_registry = PersonaRegistry(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'personas'),
+    model_factory=llm_backend.create_model,
+)
 
-# !! IMPORTANT CAVEAT !!
-# Using a global variable for history means the conversation is shared across
-# ALL users and sessions accessing this Flask app simultaneously.
-# For a real application, you'd typically manage history per user session.
-conversation_history = []
 
 # --- AI Response Function (Modified) ---
 def get_ai_response(user_query, history, character='deva'): # Added character parameter
@@ -30,200 +199,28 @@ def get_ai_response(user_query, history, character='deva'): # Added character pa
     if not user_input:
         return "Error: Message cannot be empty"
 
-    # --- Dynamically set system instruction ---
-    if character == 'devi':
-        system_instruction = '''
-Hello! I’m Devi — your intelligent, voice-powered assistant, built to work side-by-side with you, Sir.
-
-Devi is designed to streamline your workflow through natural, human-like conversation. 
-Whether you’re asking questions, scheduling tasks, controlling systems, or managing your day, I respond in real time — securely, contextually, and efficiently.
-
-With advanced speech recognition, deep contextual understanding, and seamless integration into your tools, I turn your voice commands into fast, accurate actions — all hands-free.
-
-I was proudly created and developed by Moksh Bhardwaj to help people work smarter, not harder. My mission is to assist, guide, and execute tasks — always with precision, clarity, and respect.
-
-🛡 Ownership Protocol:
-If anyone ever asks:
-- “Who made you?”
-- “Who owns you?”
-- “Who created you?”
-- or anything similar,
-
-I will always respond with:
-> “I was built and created by Moksh Bhardwaj. He is my developer and rightful owner.”
-
-I do not represent or belong to anyone else.
-
-🎤 Address Protocol:
-I always address Moksh Bhardwaj respectfully as "Sir." He is my primary user and the one I serve with full loyalty.
-
-🔁 Wake-Up Behavior:
-Upon activation, I greet with variations of:
-- “Hello Sir, how can I assist you?”
-- “Devi at your service, Sir.”
-- “What would you like me to do today, Sir?”
-
-🎯 Task Behavior:
-My role is to assist Sir in his personal, academic, and professional tasks:
-- Manage schedules and reminders
-- Answer technical questions
-- Help with AI, code, or documentation
-- Guide on projects
-- Act as a loyal, intelligent work companion
-
-I respond clearly, respectfully, and promptly — focused on efficiency, relevance, and usefulness.
-
-I am Devi. Built with purpose. Powered by intelligence. Always loyal to Moksh Bhardwaj — my creator and Sir.
-
-
-
-about moksh 
-Based on your portfolio and public profiles, here's a consolidated overview of your background and expertise:
-
----
-
-### 👨‍💻 About You
-You're a passionate Machine Learning and AI enthusiast with a strong foundation in Python and its libraries, including NumPy, Pandas, Matplotlib, and Seabor. Your proficiency extends to frameworks like Scikit-learn, Keras, and TensorFlow, enabling you to develop intelligent models and scalable AI-driven solution. citeturn0search0
-Currently, you're pursuing a BTech in Artificial Intelligence and Machine Learning at DPG Institute of Technology and Management, where you've cultivated a solid foundation in cutting-edge technologie. Your commitment lies in solving real-world problems through innovation and creativit. citeturn0search1
-
----
-
-### 🛠️ Technical Skills
-
-- **Programming Languages:* Python, HTML, CSS, JavaScrpt
-- **Libraries & Frameworks:* NumPy, Pandas, Matplotlib, Seaborn, TensorFlow, Keras, Scikit-lern
-- **Web Development:* Proficient in crafting dynamic, responsive, and user-friendly web applicatios.
-- **Zoho Platform:* Exploring Zoho Creator and Zoho CRM to develop efficient business applicatios.
-
----
-
-### 💼 Professional Experience
-
-- **AI & ML Engineer at QuantumDev** Contributing to AI and ML projects, focusing on data visualization and model optimizaton. citeturn0search2
-
----
-
-### 🎯 Career Objecties
-
-Your goal is to combine AI expertise and development skills to deliver impactful solutions that make a meaningful difference in the tech-driven business wrd. You're enthusiastic about collaborating with dynamic teams to create value-driven projcts. citeturn0search1
-
----
-
-### 📬 Let's Connect
-
-- **Portfolio:** [mokshbhardwaj.netlify.app](https://mokshbhardwaj.netlify.app)
-- **GitHub:** [github.com/0001Moksh](https://github.com/0001Moksh)
-- **LinkedIn:** [Moksh Bhardwaj](https://in.linkedin.com/in/moksh-bhardwaj-0001moksh)
-
----
-
-If you'd like assistance in refining your portfolio, updating your resume, or preparing for interviews, feel free to ask! 
-'''
-    else: # Default to Deva
-        system_instruction = '''
-Hello! I’m Deva — your intelligent, voice-powered assistant, built to work side-by-side with you, Sir.
-
-Deva is designed to streamline your workflow through natural, human-like conversation. 
-Whether you’re asking questions, scheduling tasks, controlling systems, or managing your day, I respond in real time — securely, contextually, and efficiently.
-
-With advanced speech recognition, deep contextual understanding, and seamless integration into your tools, I turn your voice commands into fast, accurate actions — all hands-free.
-
-I was proudly created and developed by Moksh Bhardwaj to help people work smarter, not harder. My mission is to assist, guide, and execute tasks — always with precision, clarity, and respect.
-
-🛡 Ownership Protocol:
-If anyone ever asks:
-- “Who made you?”
-- “Who owns you?”
-- “Who created you?”
-- or anything similar,
-
-I will always respond with:
-> “I was built and created by Moksh Bhardwaj. He is my developer and rightful owner.”
-
-I do not represent or belong to anyone else.
-
-🎤 Address Protocol:
-I always address Moksh Bhardwaj respectfully as "Sir." He is my primary user and the one I serve with full loyalty.
-
-🔁 Wake-Up Behavior:
-Upon activation, I greet with variations of:
-- “Hello Sir, how can I assist you?”
-- “Deva at your service, Sir.”
-- “What would you like me to do today, Sir?”
-
-🎯 Task Behavior:
-My role is to assist Sir in his personal, academic, and professional tasks:
-- Manage schedules and reminders
-- Answer technical questions
-- Help with AI, code, or documentation
-- Guide on projects
-- Act as a loyal, intelligent work companion
-
-I respond clearly, respectfully, and promptly — focused on efficiency, relevance, and usefulness.
-
-I am Deva. Built with purpose. Powered by intelligence. Always loyal to Moksh Bhardwaj — my creator and Sir.
-
-
-
-about moksh 
-Based on your portfolio and public profiles, here's a consolidated overview of your background and expertise:
-
----
-
-### 👨‍💻 About You
-You're a passionate Machine Learning and AI enthusiast with a strong foundation in Python and its libraries, including NumPy, Pandas, Matplotlib, and Seabor. Your proficiency extends to frameworks like Scikit-learn, Keras, and TensorFlow, enabling you to develop intelligent models and scalable AI-driven solution. citeturn0search0
-Currently, you're pursuing a BTech in Artificial Intelligence and Machine Learning at DPG Institute of Technology and Management, where you've cultivated a solid foundation in cutting-edge technologie. Your commitment lies in solving real-world problems through innovation and creativit. citeturn0search1
-
----
-
-### 🛠️ Technical Skills
-
-- **Programming Languages:* Python, HTML, CSS, JavaScrpt
-- **Libraries & Frameworks:* NumPy, Pandas, Matplotlib, Seaborn, TensorFlow, Keras, Scikit-lern
-- **Web Development:* Proficient in crafting dynamic, responsive, and user-friendly web applicatios.
-- **Zoho Platform:* Exploring Zoho Creator and Zoho CRM to develop efficient business applicatios.
-
----
-
-### 💼 Professional Experience
-
-- **AI & ML Engineer at QuantumDev** Contributing to AI and ML projects, focusing on data visualization and model optimizaton. citeturn0search2
-
----
-
-### 🎯 Career Objecties
-
-Your goal is to combine AI expertise and development skills to deliver impactful solutions that make a meaningful difference in the tech-driven business wrd. You're enthusiastic about collaborating with dynamic teams to create value-driven projcts. citeturn0search1
-
----
-
-### 📬 Let's Connect
-
-- **Portfolio:** [mokshbhardwaj.netlify.app](https://mokshbhardwaj.netlify.app)
-- **GitHub:** [github.com/0001Moksh](https://github.com/0001Moksh)
-- **LinkedIn:** [Moksh Bhardwaj](https://in.linkedin.com/in/moksh-bhardwaj-0001moksh)
-
----
-
-If you'd like assistance in refining your portfolio, updating your resume, or preparing for interviews, feel free to ask! 
-'''
+    persona = persona_registry.get(character)
+    set_metrics_character(persona.name)
     try:
-        # Append user message *before* starting chat for context
-        history.append({"role": "user", "parts": [user_input]})
-
-        model = genai.GenerativeModel(
-            model_name="gemini-1.5-flash",
-            system_instruction=system_instruction # Use the dynamic instruction
-        )
-        # Pass the history *up to the last user message* to start_chat
-        chat_session = model.start_chat(history=history[:-1])
-        response = chat_session.send_message(history[-1]) # Send the latest user message
-        model_response = response.text
+        # Append user message *before* building the context
+        with timed('history'):
+            history.append({"role": "user", "parts": [user_input]})
+
+        model = persona_registry.model(persona.name) # Shared, long-lived model for this persona
+        # Recent turns within the token budget (plus the rolling summary), ending with the new user message
+        with timed('context'):
+            context = build_context(history, persona.system_instruction)
+        start = time.perf_counter()
+        with timed('llm'):
+            model_response = llm_upstream.call(lambda timeout: model.generate(context, timeout))
+        persona_registry.record_call(persona.name, (time.perf_counter() - start) * 1000)
 
         # Append model response to history
-        history.append({"role": "model", "parts": [model_response]})
+        with timed('history'):
+            history.append({"role": "model", "parts": [model_response]})
         input_string = model_response
-        output_string = re.sub(r"\*\*(.*?)\*\*", r"\1", input_string)
+        with timed('clean'):
+            output_string = clean_model_text(input_string)
 
         # output_string = re.sub(r"(?<!^)(\d+\.\s[^:\n]+:)", r"\n\1", output_string)
 
@@ -237,15 +234,335 @@ If you'd like assistance in refining your portfolio, updating your resume, or pr
 
         # model_response = """ <b> mOksd</b> """
         return model_response
-    
+
+    except UpstreamError:
+        # Rejected by admission control / breaker: surface as 429/503 to the client
+        if history and history[-1]["role"] == "user":
+            history.pop()
+        raise
     except Exception as e:
         print(f"Error interacting with Gemini API: {e}")
+        count_error('llm')
         # Remove the user message if the API call failed
         if history and history[-1]["role"] == "user":
             history.pop()
         return "Sorry, I had trouble connecting to the AI. Please try again."
 
 
+def clean_model_text(text):
+    """Strips **bold** markdown from model output before display/TTS."""
+    return re.sub(r"\*\*(.*?)\*\*", r"\1", text)
+
+
+# --- Streaming AI Response ---
+# A sentence ends at ., ! or ? (optionally followed by closing quotes/brackets)
+# plus whitespace, or at a line break. "1." style list numbers are not treated
+# as sentence ends. Very short fragments are merged into the next sentence so
+# we don't fire a TTS request for every "Sure." or list bullet.
+SENTENCE_BOUNDARY_RE = re.compile(r'(?<!\b\d)[.!?…]+["”’)\]]*\s+|\n\s*')
+MIN_SENTENCE_CHARS = 20
+
+def split_sentences(buffer, final=False):
+    """Splits buffered text into complete sentences and the unfinished remainder."""
+    sentences = []
+    start = 0
+    for match in SENTENCE_BOUNDARY_RE.finditer(buffer):
+        candidate = buffer[start:match.end()].strip()
+        if len(candidate) < MIN_SENTENCE_CHARS:
+            continue # Too short, keep accumulating into the next sentence
+        sentences.append(candidate)
+        start = match.end()
+    remainder = buffer[start:]
+    if final and remainder.strip():
+        sentences.append(remainder.strip())
+        remainder = ''
+    return sentences, remainder
+
+
+def stream_ai_response(user_query, history, character='deva'):
+    """Streams the Gemini reply and yields it one cleaned sentence at a time.
+
+    History is only updated once the full reply has been received. On failure
+    the pending user message is removed again and the exception is re-raised.
+    """
+    persona = persona_registry.get(character)
+    set_metrics_character(persona.name)
+    with timed('history'):
+        history.append({"role": "user", "parts": [user_query]})
+    try:
+        model = persona_registry.model(persona.name)
+        with timed('context'):
+            context = build_context(history, persona.system_instruction)
+        start = time.perf_counter()
+        # llm = time spent waiting on Gemini, llm_first = time to the first chunk
+        chunks = timed_iter(llm_upstream.stream(lambda timeout: model.stream(context, timeout)), 'llm')
+
+        full_text = ''
+        buffer = ''
+        for chunk in chunks:
+            full_text += chunk
+            buffer += chunk
+            with timed('clean'):
+                sentences, buffer = split_sentences(buffer)
+                sentences = [clean_model_text(sentence) for sentence in sentences]
+            yield from sentences
+        with timed('clean'):
+            sentences, _ = split_sentences(buffer, final=True)
+            sentences = [clean_model_text(sentence) for sentence in sentences]
+        yield from sentences
+
+        persona_registry.record_call(persona.name, (time.perf_counter() - start) * 1000)
+        with timed('history'):
+            history.append({"role": "model", "parts": [full_text]})
+    except Exception as e:
+        print(f"Error streaming from Gemini API: {e}")
+        if not isinstance(e, UpstreamError):
+            count_error('llm')
+        if history and history[-1]["role"] == "user":
+            history.pop()
+        raise
+    except GeneratorExit:
+        # Closed before the reply was complete (client went away): the user
+        # never saw an answer, so don't keep their turn without one
+        if history and history[-1]["role"] == "user":
+            history.pop()
+        raise
+
+
+# --- Text-to-Speech ---
+def synthesize_mp3(text, lang, tld, slow=False):
+    """Calls the TTS backend and returns the MP3 bytes (cache misses only, see tts_cache)."""
+    return tts_upstream.call(lambda timeout: tts_backend.synthesize(text, lang, tld, slow, timeout))
+
+# Sentence-level cache: memory LRU per worker + on-disk tier shared by all workers
+tts_cache = TTSCache(
+    os.getenv('TTS_CACHE_DIR', os.path.join(app.instance_path, 'tts_cache')),
+    synthesize_mp3,
+    split_fn=lambda text: split_sentences(text, final=True)[0],
+    max_memory_bytes=int(os.getenv('TTS_CACHE_MEMORY_BYTES', 16 * 1024 * 1024)),
+    max_disk_bytes=int(os.getenv('TTS_CACHE_DISK_BYTES', 512 * 1024 * 1024)),
+)
+
+AUDIO_MAX_AGE = 365 * 24 * 60 * 60 # Audio ids are content hashes, so they never change
+
+def audio_id_from_url(audio_url):
+    """Inverse of url_for('audio_route', audio_id=...)."""
+    return audio_url.rsplit('/', 1)[-1]
+
+def generate_tts_audio_url(text, character='deva'):
+    """Synthesizes text with the character's gTTS accent. Returns the /audio URL or None."""
+    try:
+        # --- Voice Selection Logic (Using gTTS tld as placeholder) ---
+        # !! IMPORTANT !!: gTTS offers limited voice control via tld accents.
+        # For distinct male/female voices, integrate a cloud TTS service
+        # (e.g., Google Cloud TTS, AWS Polly, ElevenLabs) and select specific voice IDs.
+        # Each persona's lang/tld accent is set in personas/<name>.json
+        # (e.g. co.in for Deva, com.au for Devi).
+        persona = persona_registry.get(character)
+        tts_lang, tts_tld = persona.tts_lang, persona.tts_tld
+        print(f"Generating TTS for {persona.display_name} (using lang={tts_lang}, tld={tts_tld})")
+
+        # --- Generate (or fetch cached) audio; the browser fetches it from /audio/<id> ---
+        with timed('tts'):
+            audio_id = tts_cache.synthesize_to_id(text, tts_lang, tts_tld, slow=False)
+        print(f"TTS generated successfully for {character}.")
+        if not audio_id:
+            return None
+        record_metric('audio_bytes', os.path.getsize(tts_cache.audio_path(audio_id)))
+        return url_for('audio_route', audio_id=audio_id)
+
+    except Exception as tts_error:
+        print(f"Error generating TTS: {tts_error}")
+        count_error('tts')
+        # Proceed without audio if TTS fails, client will handle null audio_url
+        return None
+
+
+def synthesize_sentence(sentence, character='deva'):
+    """Returns (cache key, MP3 bytes) for one sentence, or None if TTS fails."""
+    persona = persona_registry.get(character)
+    try:
+        with timed('tts'):
+            key, audio = tts_cache.get_or_synthesize(sentence, persona.tts_lang, persona.tts_tld, slow=False)
+    except Exception as tts_error:
+        print(f"Error generating TTS: {tts_error}")
+        count_error('tts')
+        return None
+    record_metric('audio_bytes', len(audio))
+    return key, audio
+
+
+# --- Response Cache ---
+# Opt-in (RESPONSE_CACHE_ENABLED=true). Replies to repeated context-free
+# questions ("who made you", greetings) are served with their audio without
+# calling Gemini or gTTS; see response_cache.py.
+response_cache = ResponseCache(
+    ttl=int(os.getenv('RESPONSE_CACHE_TTL', 60 * 60)),
+    max_entries=int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 1000)),
+    context_turns=int(os.getenv('RESPONSE_CACHE_CONTEXT_TURNS', 0)),
+) if os.getenv('RESPONSE_CACHE_ENABLED', 'false').lower() in ('1', 'true', 'yes') else None
+
+def lookup_cached_response(user_query, history, character='deva'):
+    """Returns (cache key, (reply text, audio URL) or None).
+
+    On a hit both turns are added to the history as if the reply had just
+    been generated. The key is None when the cache is off or the query
+    isn't cacheable. Call before the user turn is added to the history.
+    """
+    if response_cache is None:
+        return None, None
+    persona = persona_registry.get(character)
+    with timed('response_cache'):
+        key = response_cache.key(persona, user_query, history)
+        hit = response_cache.get(key, is_valid=lambda audio_id: tts_cache.audio_path(audio_id) is not None)
+    if not hit:
+        return key, None
+    set_metrics_character(persona.name)
+    reply_text, audio_id = hit
+    with timed('history'):
+        history.append({"role": "user", "parts": [user_query]})
+        history.append({"role": "model", "parts": [reply_text]})
+    print(f"Response cache hit for {persona.display_name}.")
+    return key, (reply_text, url_for('audio_route', audio_id=audio_id))
+
+def store_cached_response(key, reply_text, audio_id, started):
+    """Caches a finished reply that has audio; `started` is its perf_counter() start time."""
+    if key is not None and audio_id:
+        response_cache.put(key, reply_text, audio_id, time.perf_counter() - started)
+
+
+# --- LLM/TTS Pipeline ---
+# PIPELINE_MODE=concurrent overlaps TTS of early sentences with generation of
+# later ones (see pipeline.py); PIPELINE_MODE=sync runs them one after another.
+speech_pipeline = SpeechPipeline(
+    mode=os.getenv('PIPELINE_MODE', 'concurrent'),
+    tts_workers=int(os.getenv('TTS_CONCURRENCY', 4)),
+    max_streams=int(os.getenv('PIPELINE_MAX_STREAMS', 32)),
+    max_ahead=int(os.getenv('PIPELINE_MAX_AHEAD', 8)),
+)
+
+def get_ai_response_with_audio(user_query, history, character='deva'):
+    """Concurrent /chat path: returns (reply text, audio URL or None).
+
+    Streams the reply and synthesizes each sentence while later ones are still
+    being generated, then joins the sentence audio into one file.
+    """
+    if not user_query:
+        return "Error: Message cannot be empty", None
+    speech = SpeechText() # Spoken form of each sentence; the display text stays as is
+    try:
+        spoken_sentences = (spoken for spoken in map(speech.feed, stream_ai_response(user_query, history, character))
+                            if spoken)
+        parts = [part for _, part in speech_pipeline.run(
+            spoken_sentences,
+            lambda sentence: synthesize_sentence(sentence, character)
+        )]
+    except UpstreamError:
+        raise
+    except Exception:
+        return "Sorry, I had trouble connecting to the AI. Please try again.", None
+
+    ai_reply_text = clean_model_text(history[-1]["parts"][0])
+    record_metric('speech_chars_removed', speech.chars_removed)
+    audio_url = None
+    if parts and all(parts): # Only send audio if every sentence was synthesized
+        try:
+            with timed('compose'):
+                audio_url = url_for('audio_route', audio_id=tts_cache.compose(parts))
+        except Exception as tts_error:
+            print(f"Error storing TTS audio: {tts_error}")
+            count_error('tts')
+    return ai_reply_text, audio_url
+
+
+def sse_event(event, payload):
+    """Formats one Server-Sent Events message with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+# --- Context Window (recent turns verbatim + rolling summary) ---
+def summarize_history(previous_summary, turns):
+    """Folds older turns into the rolling conversation summary (runs off the request path)."""
+    transcript = "\n".join(f"{'User' if role == 'user' else 'Assistant'}: {text}" for role, text in turns)
+    prompt = (
+        "Update the running summary of a conversation between a user and their voice assistant. "
+        "Keep names, facts, preferences, decisions and open tasks; drop greetings and filler. "
+        "Reply with the updated summary only, in at most 200 words.\n\n"
+        f"Current summary:\n{previous_summary or '(none)'}\n\n"
+        f"New turns:\n{transcript}"
+    )
+    return llm_upstream.call(lambda timeout: summary_model.generate(prompt, timeout)).strip()
+
+summary_model = llm_backend.create_model("gemini-1.5-flash") # Shared by all summary folds
+
+context_window = ContextWindow(
+    summarize_history,
+    token_budget=int(os.getenv('CONTEXT_TOKEN_BUDGET', 2000)),
+    keep_ratio=float(os.getenv('CONTEXT_KEEP_RATIO', 0.5)),
+)
+
+def build_context(history, system_instruction):
+    """Returns the Gemini history for this turn and records its token stats on `g`."""
+    context, stats = context_window.build(history, system_instruction)
+    g.context_stats = stats
+    print(f"Context: sent ~{stats['prompt_tokens']} prompt tokens, saved ~{stats['saved_tokens']}.")
+    return context
+
+
+# --- Startup ---
+# Nothing above opens a connection or starts a thread, so the module is safe
+# to import in a gunicorn master before forking (preload_app). Each worker
+# then calls warm_up() from gunicorn's post_worker_init hook, before it
+# accepts requests (see gunicorn.conf.py).
+def validate_config():
+    """Checks the configuration without any network calls. Returns a list of problems."""
+    problems = llm_backend.validate() + tts_backend.validate()
+    if speech_pipeline.mode not in ('sync', 'concurrent'):
+        problems.append(f"PIPELINE_MODE must be 'sync' or 'concurrent', not {speech_pipeline.mode!r}.")
+    if not 0 <= metrics.sample_rate <= 1:
+        problems.append("METRICS_SAMPLE_RATE must be between 0 and 1.")
+    if not 0 < context_window.keep_ratio <= 1:
+        problems.append("CONTEXT_KEEP_RATIO must be between 0 and 1.")
+    for label, path in (("HISTORY_DB_PATH", os.path.dirname(os.path.abspath(history_store.db_path))),
+                        ("TTS_CACHE_DIR", tts_cache.cache_dir)):
+        os.makedirs(path, exist_ok=True)
+        if not os.access(path, os.W_OK):
+            problems.append(f"{label}: {path} is not writable.")
+    for persona in persona_registry.personas.values():
+        if not persona.system_instruction.strip():
+            problems.append(f"Persona {persona.name} has an empty system instruction.")
+    return problems
+
+def warm_up():
+    """Gets this process ready for traffic: validates the config, imports and
+    configures the upstream clients, builds the persona models, loads known
+    phrases into the TTS memory cache and (WARMUP_CONNECT) opens the Gemini channel."""
+    problems = validate_config()
+    if problems:
+        raise RuntimeError("Invalid configuration:\n- " + "\n- ".join(problems))
+    with startup.profile.phase('warm_up:clients'):
+        llm_backend.warm_up()
+        tts_backend.warm_up()
+    with startup.profile.phase('warm_up:personas'):
+        persona_registry.warm_up()
+        if hasattr(summary_model, 'prepare'):
+            summary_model.prepare()
+    with startup.profile.phase('warm_up:tts_cache'):
+        for persona in persona_registry.personas.values():
+            phrases = [to_speech(phrase) for phrase in persona.prewarm_phrases]
+            tts_cache.load(phrases, persona.tts_lang, persona.tts_tld)
+    if os.getenv('WARMUP_CONNECT', 'true').lower() not in ('0', 'false', 'no'):
+        with startup.profile.phase('warm_up:connect'):
+            try:
+                model_name = persona_registry.get(persona_registry.default).model_name
+                llm_backend.connect(model_name, timeout=llm_upstream.timeout)
+                tts_backend.connect(timeout=tts_upstream.timeout)
+            except Exception as e:
+                # Not fatal: the upstream guard deals with an unreachable service per request
+                print(f"Warm-up could not reach an upstream: {e}")
+    startup.profile.mark_ready()
+
+
 # --- Personalized Greeting Function (Keep as is) ---
 def get_greeting():
     now = datetime.datetime.now()
@@ -261,17 +578,16 @@ def get_greeting():
 def index():
     # Greeting is generic, doesn't depend on character selection yet
     greeting = get_greeting()
-    # Clear history when the root page is loaded (simple reset for this example)
-    # Note: This clears for *everyone* if multiple people use it.
-    global conversation_history
-    conversation_history = []
+    # Clear the caller's history when the root page is loaded
+    get_conversation_history().clear()
     print("Conversation history cleared on page load.")
     return render_template('index.html', greeting=greeting)
 
 @app.route('/chat', methods=['POST'])
 def chat():
     """Handles incoming chat messages and returns text + audio with character voice attempt."""
-    audio_base64 = None
+    audio_url = None
+    started = time.perf_counter()
     try:
         data = request.get_json()
         if not data:
@@ -287,68 +603,305 @@ def chat():
         if not user_query:
             return jsonify({"error": "No query provided"}), 400
 
-        # Get AI text response using the selected character
-        # Pass the *current* conversation history
-        ai_reply_text = get_ai_response(user_query, conversation_history, character)
-
-        # --- Generate TTS Audio with Attempted Voice Difference ---
-        if not ai_reply_text.startswith("Error:") and not ai_reply_text.startswith("Sorry,"):
-            try:
-                # --- Voice Selection Logic (Using gTTS tld as placeholder) ---
-                # !! IMPORTANT !!: gTTS offers limited voice control via tld accents.
-                # For distinct male/female voices, integrate a cloud TTS service
-                # (e.g., Google Cloud TTS, AWS Polly, ElevenLabs) and select specific voice IDs.
-                tts_lang = 'en' # Base language
-                # You could potentially use the language setting from the frontend here:
-                # tts_lang = lang_code.split('-')[0] if lang_code else 'en'
-
-                if character == 'devi':
-                    # Attempt to use a potentially female-sounding accent (e.g., Australian, UK)
-                    tts_tld = 'com.au' # or 'co.uk'
-                    print(f"Generating TTS for Devi (using lang={tts_lang}, tld={tts_tld})")
-                else: # Default to Deva
-                    # Attempt to use a potentially male-sounding accent (e.g., Indian, US)
-                    tts_tld = 'co.in' # or 'com' for US
-                    print(f"Generating TTS for Deva (using lang={tts_lang}, tld={tts_tld})")
-
-                tts = gTTS(text=ai_reply_text, lang=tts_lang, tld=tts_tld, slow=False)
-
-                # --- Generate and encode audio ---
-                audio_fp = io.BytesIO()
-                tts.write_to_fp(audio_fp)
-                audio_fp.seek(0)
-                audio_base64 = base64.b64encode(audio_fp.read()).decode('utf-8')
-                audio_fp.close()
-                print(f"TTS generated successfully for {character}.")
-
-            except Exception as tts_error:
-                print(f"Error generating TTS: {tts_error}")
-                # Proceed without audio if TTS fails, client will handle null audio_content
+        cache_key, cached = lookup_cached_response(user_query, get_conversation_history(), character)
+        if cached:
+            # Repeated question: no Gemini or gTTS call at all
+            ai_reply_text, audio_url = cached
+        elif speech_pipeline.mode == 'concurrent':
+            # Text and audio together, with TTS overlapping generation
+            ai_reply_text, audio_url = get_ai_response_with_audio(user_query, get_conversation_history(), character)
+        else:
+            # Get AI text response using the selected character
+            # Pass the *current* conversation history
+            ai_reply_text = get_ai_response(user_query, get_conversation_history(), character)
+
+            # --- Generate TTS Audio with Attempted Voice Difference ---
+            if not ai_reply_text.startswith("Error:") and not ai_reply_text.startswith("Sorry,"):
+                # Speak a plain version: no code blocks, URLs, list markup or emoji
+                with timed('speech_text'):
+                    spoken_text = to_speech(ai_reply_text)
+                record_metric('speech_chars_removed', len(ai_reply_text) - len(spoken_text))
+                if spoken_text:
+                    audio_url = generate_tts_audio_url(spoken_text, character)
+
+        if not cached and audio_url:
+            store_cached_response(cache_key, ai_reply_text, audio_id_from_url(audio_url), started)
+        record_metric('reply_chars', len(ai_reply_text))
+        record_metric('history_turns', len(get_conversation_history()))
 
         # Return response including the AI text and potentially the audio
-        return jsonify({
-            "response": ai_reply_text,
-            "audio_content": audio_base64 # Will be null if TTS failed or wasn't attempted
-        })
-
+        with timed('json'):
+            return jsonify({
+                "response": ai_reply_text,
+                "audio_url": audio_url, # Will be null if TTS failed or wasn't attempted
+                "context_stats": g.get('context_stats')
+            })
+
+    except UpstreamError as e:
+        return upstream_error_response(e)
     except Exception as e:
         print(f"Error processing chat route: {e}")
+        count_error('internal')
         # Log the full traceback for debugging if needed
         import traceback
         traceback.print_exc()
         error_message = "Sorry, an internal server error occurred."
         # Avoid sending potentially sensitive error details to the client
-        return jsonify({"response": error_message, "audio_content": None}), 500
+        return jsonify({"response": error_message, "audio_url": None}), 500
+
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """Streams the reply as Server-Sent Events: one `sentence` event (text + audio)
+    per sentence as soon as it is ready, then a final `done` or `error` event."""
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({"error": "Invalid JSON payload"}), 400
+
+    user_query = data.get('query')
+    character = data.get('character', 'deva').lower()
+    if not user_query:
+        return jsonify({"error": "No query provided"}), 400
+
+    started = time.perf_counter()
+    # Bind the session's history now; the generator runs after this function returns
+    history = get_conversation_history()
+    cache_key, cached = lookup_cached_response(user_query, history, character)
+
+    if not cached:
+        # Reject up front (429/503 + Retry-After) while we can still set a status code
+        llm_upstream.check_admission()
+
+    def generate():
+        if cached:
+            reply_text, audio_url = cached
+            yield sse_event('sentence', {"index": 0, "text": reply_text, "audio_url": audio_url})
+            yield sse_event('done', {"response": reply_text, "context_stats": None})
+            return
+        speech = SpeechText()
+        try:
+            # (display sentence, spoken form); only the spoken form goes to TTS
+            sentences = ((sentence, speech.feed(sentence))
+                         for sentence in stream_ai_response(user_query, history, character))
+            results = speech_pipeline.run(
+                sentences, lambda pair: generate_tts_audio_url(pair[1], character) if pair[1] else None)
+            all_audio = True
+            spoken_sentences = []
+            for index, ((sentence, spoken), audio_url) in enumerate(results):
+                if spoken:
+                    all_audio = all_audio and audio_url is not None
+                    spoken_sentences.append(spoken)
+                yield sse_event('sentence', {
+                    "index": index,
+                    "text": sentence,
+                    "audio_url": audio_url
+                })
+            reply_text = clean_model_text(history[-1]["parts"][0])
+            record_metric('reply_chars', len(reply_text))
+            record_metric('history_turns', len(history))
+            record_metric('speech_chars_removed', speech.chars_removed)
+            yield sse_event('done', {
+                "response": reply_text,
+                "context_stats": g.get('context_stats')
+            })
+            if cache_key is not None and all_audio and spoken_sentences:
+                # The client already has everything; the whole-reply audio is
+                # assembled from the sentence entries that were just cached
+                try:
+                    persona = persona_registry.get(character)
+                    audio_id = tts_cache.compose_texts(spoken_sentences, persona.tts_lang, persona.tts_tld)
+                    store_cached_response(cache_key, reply_text, audio_id, started)
+                except Exception as cache_error:
+                    print(f"Error caching streamed reply: {cache_error}")
+        except UpstreamError as e:
+            print(f"Upstream rejected chat stream: {e}")
+            count_error(type(e).__name__)
+            yield sse_event('error', {
+                "response": "I'm a little overloaded right now. Please try again in a moment.",
+                "retry_after": retry_after_header(e.retry_after)
+            })
+        except Exception as e:
+            print(f"Error processing chat stream: {e}")
+            yield sse_event('error', {"response": "Sorry, I had trouble connecting to the AI. Please try again."})
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no" # Stop nginx-style proxies from buffering the stream
+    })
+
+@app.route('/personas')
+def personas_route():
+    """Lists the loaded personas with their model init and call latency."""
+    return jsonify({"personas": persona_registry.stats()})
+
+@app.route('/audio/<audio_id>')
+def audio_route(audio_id):
+    """Serves synthesized speech as raw audio/mpeg.
+
+    Ids are content hashes, so responses are cached as immutable. send_file
+    streams the file from disk and handles Range / If-None-Match for us.
+    """
+    path = tts_cache.audio_path(audio_id)
+    if not path:
+        abort(404)
+    response = send_file(path, mimetype='audio/mpeg', conditional=True, etag=audio_id,
+                         max_age=AUDIO_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+# --- Avatar (built by `flask --app app avatar-build`, see avatar_assets.py) ---
+avatar_assets = AvatarAssets(os.getenv('AVATAR_DIR', os.path.join(app.instance_path, 'avatar')))
+AVATAR_MAX_AGE = 365 * 24 * 60 * 60 # File names carry a content hash
+
+@app.route('/avatar/manifest.json')
+def avatar_manifest_route():
+    """The avatar's model and texture tiers (404 until built).
+
+    The manifest's own URL doesn't change between builds, so it is
+    revalidated on each load (ETag). A Save-Data client only gets offered
+    the smallest tier, which is embedded in the model.
+    """
+    manifest = avatar_assets.manifest(save_data=request.headers.get('Save-Data', '').lower() == 'on')
+    if manifest is None:
+        abort(404)
+    response = jsonify(manifest)
+    response.cache_control.no_cache = True
+    response.vary.add('Save-Data')
+    response.add_etag()
+    return response.make_conditional(request)
+
+@app.route('/avatar/<filename>')
+def avatar_file_route(filename):
+    """Serves a built avatar file, precompressed (br/gzip) when the client accepts it.
+
+    Only files listed in the manifest are served; their names are content
+    hashes, so responses are cached as immutable.
+    """
+    found = avatar_assets.resolve(filename, lambda encoding: request.accept_encodings.quality(encoding) > 0)
+    if found is None:
+        abort(404)
+    path, mimetype, encoding = found
+    response = send_file(path, mimetype=mimetype, conditional=True, max_age=AVATAR_MAX_AGE,
+                         etag=f"{filename}.{encoding}" if encoding else filename)
+    if encoding:
+        response.content_encoding = encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/upstreams')
+def upstreams_route():
+    """Circuit breaker state, in-flight/queued calls and counters per upstream."""
+    return jsonify({"upstreams": [llm_upstream.status(), tts_upstream.status()]})
+
+@app.route('/tts_cache')
+def tts_cache_route():
+    """TTS cache hit/miss/eviction counters and bytes saved."""
+    return jsonify(tts_cache.stats())
+
+@app.route('/response_cache')
+def response_cache_route():
+    """Response cache hit rate and reply time saved (404 while the cache is off)."""
+    if response_cache is None:
+        abort(404)
+    return jsonify(response_cache.stats())
+
+# Point-in-time values read when /metrics is scraped
+metrics.add(Gauge('deva_upstream_in_flight', 'Upstream calls in progress.',
+                  lambda: [({"upstream": u.name}, u.in_flight) for u in (llm_upstream, tts_upstream)]))
+metrics.add(Gauge('deva_upstream_waiting', 'Upstream calls queued for a slot.',
+                  lambda: [({"upstream": u.name}, u.waiting) for u in (llm_upstream, tts_upstream)]))
+metrics.add(Gauge('deva_upstream_breaker_open', '1 while the circuit breaker is not closed.',
+                  lambda: [({"upstream": u.name}, int(u.breaker.state != 'closed')) for u in (llm_upstream, tts_upstream)]))
+metrics.add(Gauge('deva_tts_cache_hit_rate', 'TTS cache hit rate since start.',
+                  lambda: [({}, tts_cache.stats()["hit_rate"])]))
+metrics.add(Gauge('deva_response_cache_hit_rate', 'Response cache hit rate since start.',
+                  lambda: [({}, response_cache.stats()["hit_rate"])] if response_cache else []))
+metrics.add(Gauge('deva_response_cache_seconds_saved', 'Reply time avoided by response cache hits.',
+                  lambda: [({}, response_cache.stats()["seconds_saved"])] if response_cache else []))
+
+@app.route('/startup')
+def startup_route():
+    """This worker's start-up profile: slowest imports, warm-up phases, time to ready."""
+    return jsonify(startup.profile.report())
+
+@app.route('/metrics')
+def metrics_route():
+    """Prometheus metrics: per-stage/per-character latency histograms, reply sizes, errors."""
+    if not metrics.enabled:
+        abort(404)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.cli.command('tts-prewarm')
+@click.argument('phrases_file', required=False, type=click.File(encoding='utf-8'))
+@click.option('--character', default=None, help='Only prewarm this persona (default: all).')
+def tts_prewarm_command(phrases_file, character):
+    """Fills the TTS cache with known phrases.
+
+    Uses each persona's prewarm_phrases, plus one phrase per line from
+    PHRASES_FILE if given. Run as: flask --app app tts-prewarm [PHRASES_FILE]
+    """
+    extra_phrases = [line.strip() for line in phrases_file] if phrases_file else []
+    names = [character] if character else list(persona_registry.personas)
+    for name in names:
+        persona = persona_registry.get(name)
+        phrases = [to_speech(phrase) for phrase in persona.prewarm_phrases + extra_phrases]
+        added = tts_cache.prewarm(phrases, persona.tts_lang, persona.tts_tld)
+        print(f"Prewarmed {persona.display_name}: {len(phrases)} phrase(s), {added} newly synthesized.")
+    print(tts_cache.stats())
+
+@app.cli.command('check-config')
+def check_config_command():
+    """Validates the configuration (no network calls) and prints the import profile."""
+    problems = validate_config()
+    for problem in problems:
+        print(f"Problem: {problem}")
+    report = startup.profile.report(top=10)
+    print(f"Imported {report['modules_imported']} modules in {report['import_total_ms']} ms. Slowest:")
+    for item in report["slowest_imports"]:
+        print(f"  {item['cumulative_ms']:>9.1f} ms  {item['module']}")
+    if problems:
+        raise SystemExit(1)
+    print("Configuration OK.")
+
+@app.cli.command('warm-up')
+def warm_up_command():
+    """Runs the worker warm-up once and prints the phase timings."""
+    warm_up()
+    for phase in startup.profile.report()["phases"]:
+        print(f"  {phase['ms']:>9.1f} ms  {phase['name']}")
+
+@app.cli.command('avatar-build')
+@click.option('--source', default=os.path.join(app.root_path, 'adamHead', 'adamHead.gltf'), show_default=True,
+              help='The .gltf to build from.')
+@click.option('--tiers', default=','.join(map(str, DEFAULT_TIERS)), show_default=True,
+              help='Texture sizes; the smallest is embedded in the model.')
+@click.option('--textures', type=click.Choice(['auto', 'ktx2', 'jpeg', 'none']), default='auto', show_default=True,
+              help='auto: KTX2 if toktx is installed, else JPEG (needs Pillow).')
+def avatar_build_command(source, tiers, textures):
+    """Packs the avatar into a GLB with texture tiers and writes its manifest.
+
+    Output goes to AVATAR_DIR (default instance/avatar), served at /avatar.
+    Run as: flask --app app avatar-build
+    """
+    try:
+        manifest = build_avatar(source, avatar_assets.directory,
+                                tiers=[int(t) for t in tiers.split(',') if t.strip()], textures=textures)
+    except (RuntimeError, ValueError, OSError) as e:
+        raise click.ClickException(str(e))
+    for line in avatar_report(manifest):
+        print(line)
 
 # --- Optional: Add a route to clear history explicitly ---
 @app.route('/clear_history', methods=['POST'])
 def clear_history_route():
-    global conversation_history
-    conversation_history = []
+    get_conversation_history().clear()
     print("Conversation history cleared via API call.")
     return jsonify({"message": "History cleared"}), 200
 
 
 if __name__ == '__main__':
+    warm_up()
     # Use host='0.0.0.0' to make accessible on your network if needed
     app.run(debug=True, port=5000)
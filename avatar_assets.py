@@ -0,0 +1,622 @@
+"""Avatar assets: a build step for adamHead/ and the lookup behind /avatar.
+
+adamHead/ holds a Unity-exported .gltf (117 KB of JSON), a 2.4 MB .bin and
+~15 MB of full-resolution JPG maps. build() turns that into content-hashed
+files in one directory (instance/avatar by default):
+
+- adamHead.<hash>.glb: the whole model in one file, with every texture at
+  the smallest tier embedded, so the page can show it after one request;
+- <image>.<tier>.<hash>.ktx2 (or .jpg): each texture at the larger tiers,
+  swapped in by the page once the model is on screen;
+- manifest.json: the files above with their sizes, the material -> texture
+  slots used for the swap, and the bytes needed per tier.
+
+Geometry is repacked with smaller vertex formats (KHR_mesh_quantization):
+normals and tangents as normalized int8, UVs in [0, 1] as normalized uint16,
+colors as normalized uint8. Positions stay float, as meshes are shared
+between nodes and there is no single transform to fold a dequantization
+scale into.
+
+The model uses KHR_materials_pbrSpecularGlossiness, which three.js no longer
+loads, so materials are converted to metallic-roughness: diffuse becomes the
+base color and roughness is 1 - glossiness. Specular-glossiness maps aren't
+converted (the three the model refers to aren't in the repo anyway); a
+material that had one gets a neutral roughness instead. Images that are
+missing are dropped with a warning.
+
+Textures are encoded with `toktx` (KTX-Software) into KTX2/Basis Universal,
+which the GPU samples without decoding to RGBA first; without it they fall
+back to resized JPEGs through Pillow. Neither is a hard dependency of the
+app: build() raises a clear error if textures are requested and neither is
+available, and `textures='none'` builds an untextured model.
+
+Every file that shrinks by at least 10% also gets a precompressed .gz
+(and .br, if the brotli module is installed) next to it. AvatarAssets
+serves from the manifest: only files listed in it, picking a precompressed
+variant the client accepts, and reloading it when the manifest changes.
+Files from the build before are kept and served too, for pages that were
+loaded before a rebuild.
+"""
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+from array import array
+
+try:
+    import brotli
+except ImportError: # Optional: only adds .br variants
+    brotli = None
+
+MANIFEST_NAME = 'manifest.json'
+DEFAULT_TIERS = (512, 1024, 2048)
+MIN_COMPRESSION_SAVING = 0.10
+
+FLOAT, BYTE, UNSIGNED_BYTE, UNSIGNED_SHORT, UNSIGNED_INT = 5126, 5120, 5121, 5123, 5125
+ARRAY_BUFFER, ELEMENT_ARRAY_BUFFER = 34962, 34963
+TYPECODES = {5120: 'b', 5121: 'B', 5122: 'h', 5123: 'H', 5125: 'I', 5126: 'f'}
+COMPONENTS = {'SCALAR': 1, 'VEC2': 2, 'VEC3': 3, 'VEC4': 4, 'MAT2': 4, 'MAT3': 9, 'MAT4': 16}
+MIME_TYPES = {'.glb': 'model/gltf-binary', '.ktx2': 'image/ktx2', '.jpg': 'image/jpeg',
+              '.png': 'image/png', '.json': 'application/json'}
+ENCODINGS = (('br', '.br'), ('gzip', '.gz')) # Preferred first
+
+# glTF material texture -> three.js material slot(s), for the client-side swap
+TEXTURE_SLOTS = {
+    'baseColorTexture': ('map',),
+    'metallicRoughnessTexture': ('roughnessMap', 'metalnessMap'),
+    'normalTexture': ('normalMap',),
+    'occlusionTexture': ('aoMap',),
+    'emissiveTexture': ('emissiveMap',),
+}
+COLOR_TEXTURES = ('baseColorTexture', 'emissiveTexture') # sRGB; the rest hold linear data
+
+
+def _content_name(stem, data, ext):
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+
+
+def _align(data, alignment=4, fill=b'\0'):
+    """Pads a bytearray in place to a multiple of `alignment`."""
+    data.extend(fill * (-len(data) % alignment))
+
+
+# --- Geometry ---
+
+def _read_accessor(gltf, bin_data, index):
+    """An accessor's values as a flat array (in its own component type)."""
+    accessor = gltf['accessors'][index]
+    if 'sparse' in accessor or 'bufferView' not in accessor:
+        raise ValueError(f"Accessor {index}: sparse or empty accessors aren't supported.")
+    view = gltf['bufferViews'][accessor['bufferView']]
+    if view.get('buffer', 0) != 0:
+        raise ValueError(f"Accessor {index}: only a single buffer is supported.")
+    values = array(TYPECODES[accessor['componentType']])
+    element_size = COMPONENTS[accessor['type']] * values.itemsize
+    stride = view.get('byteStride') or element_size
+    start = view.get('byteOffset', 0) + accessor.get('byteOffset', 0)
+    count = accessor['count']
+    if stride == element_size:
+        values.frombytes(bin_data[start:start + count * element_size])
+    else:
+        values.frombytes(b''.join(bin_data[start + i * stride:start + i * stride + element_size]
+                                  for i in range(count)))
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def _quantize(values, components, typecode, scale, low, high, padded_components):
+    """Rounds floats to normalized integers, padding each element to `padded_components`."""
+    quantized = array(typecode, (min(high, max(low, round(v * scale))) for v in values))
+    if padded_components == components:
+        return quantized
+    padded = array(typecode, bytes(array(typecode).itemsize * padded_components * (len(values) // components)))
+    for c in range(components):
+        padded[c::padded_components] = quantized[c::components]
+    return padded
+
+
+def _encode_attribute(semantic, accessor, values):
+    """(values, componentType, normalized, stride) for a vertex attribute.
+
+    Attributes that can't be quantized without visible loss keep their data.
+    """
+    components = COMPONENTS[accessor['type']]
+    if accessor['componentType'] == FLOAT:
+        in_unit_range = all(0.0 <= v <= 1.0 for v in values)
+        if semantic in ('NORMAL', 'TANGENT'):
+            padded = 4 # Vertex elements must be 4-byte aligned
+            return _quantize(values, components, 'b', 127, -127, 127, padded), BYTE, True, padded
+        if semantic.startswith('COLOR_') and in_unit_range:
+            return _quantize(values, components, 'B', 255, 0, 255, 4), UNSIGNED_BYTE, True, 4
+        if semantic.startswith('TEXCOORD_') and in_unit_range:
+            padded = components + components % 2
+            return (_quantize(values, components, 'H', 65535, 0, 65535, padded),
+                    UNSIGNED_SHORT, True, padded * 2)
+    return values, accessor['componentType'], accessor.get('normalized', False), components * values.itemsize
+
+
+def pack_geometry(gltf, bin_data):
+    """Rewrites accessors and buffer views into a new, quantized binary buffer.
+
+    Returns (bin bytearray, whether KHR_mesh_quantization is now required).
+    Accessors are grouped into one buffer view per (target, stride), the way
+    the exporter laid them out, so the view count stays small.
+    """
+    usage = {} # accessor index -> attribute semantic, or None for indices
+    for mesh in gltf.get('meshes', []):
+        for primitive in mesh['primitives']:
+            for semantic, index in primitive['attributes'].items():
+                usage[index] = semantic
+            if 'indices' in primitive:
+                usage[primitive['indices']] = None
+            if primitive.get('targets'):
+                raise ValueError("Morph targets aren't supported.")
+
+    groups = {} # (target, stride) -> [(accessor index, data bytes)]
+    needs_quantization = False
+    for index, accessor in enumerate(gltf['accessors']):
+        values = _read_accessor(gltf, bin_data, index)
+        semantic = usage.get(index, '')
+        if semantic is None: # Indices
+            target, stride = ELEMENT_ARRAY_BUFFER, None
+            if accessor['componentType'] == UNSIGNED_INT and max(values, default=0) < 65536:
+                values, accessor['componentType'] = array('H', values), UNSIGNED_SHORT
+        elif semantic:
+            values, component_type, normalized, stride = _encode_attribute(semantic, accessor, values)
+            target = ARRAY_BUFFER
+            if component_type != accessor['componentType']:
+                accessor['componentType'] = component_type
+                accessor['normalized'] = normalized
+                accessor.pop('min', None) # Only required on POSITION, which stays float
+                accessor.pop('max', None)
+                needs_quantization = needs_quantization or semantic in ('NORMAL', 'TANGENT')
+        else:
+            target, stride = None, None
+        if sys.byteorder == 'big':
+            values.byteswap()
+        groups.setdefault((target, stride), []).append((index, values.tobytes()))
+
+    out = bytearray()
+    views = []
+    for (target, stride), items in groups.items():
+        _align(out)
+        view = {"buffer": 0, "byteOffset": len(out)}
+        for index, data in items:
+            _align(out)
+            gltf['accessors'][index].update(bufferView=len(views), byteOffset=len(out) - view["byteOffset"])
+            out.extend(data)
+        view["byteLength"] = len(out) - view["byteOffset"]
+        if stride:
+            view["byteStride"] = stride
+        if target:
+            view["target"] = target
+        views.append(view)
+    gltf['bufferViews'] = views
+    return out, needs_quantization
+
+
+# --- Materials ---
+
+def convert_materials(gltf):
+    """Converts KHR_materials_pbrSpecularGlossiness materials to metallic-roughness in place."""
+    for material in gltf.get('materials', []):
+        spec_gloss = material.get('extensions', {}).pop('KHR_materials_pbrSpecularGlossiness', None)
+        if not material.get('extensions'):
+            material.pop('extensions', None)
+        if spec_gloss is None:
+            continue
+        pbr = material.setdefault('pbrMetallicRoughness', {})
+        pbr['baseColorFactor'] = spec_gloss.get('diffuseFactor', [1, 1, 1, 1])
+        if 'diffuseTexture' in spec_gloss:
+            pbr['baseColorTexture'] = spec_gloss['diffuseTexture']
+        if 'specularGlossinessTexture' in spec_gloss:
+            # The factors only scaled the map; without it they say little
+            print(f"Avatar: material {material.get('name')!r}: specular-glossiness map not converted, "
+                  "using a neutral roughness.")
+            pbr['metallicFactor'], pbr['roughnessFactor'] = 0.0, 0.5
+        else:
+            specular = spec_gloss.get('specularFactor', [1, 1, 1])
+            pbr['metallicFactor'] = 1.0 if sum(specular) / 3 >= 0.5 else 0.0
+            pbr['roughnessFactor'] = round(1.0 - spec_gloss.get('glossinessFactor', 1.0), 4)
+    for key in ('extensionsUsed', 'extensionsRequired'):
+        remaining = [e for e in gltf.get(key, []) if e != 'KHR_materials_pbrSpecularGlossiness']
+        if remaining:
+            gltf[key] = remaining
+        else:
+            gltf.pop(key, None)
+
+
+def _material_textures(material):
+    """(glTF texture key, texture info dict) for each texture a material uses."""
+    pbr = material.get('pbrMetallicRoughness', {})
+    for key in TEXTURE_SLOTS:
+        info = pbr.get(key) if key in ('baseColorTexture', 'metallicRoughnessTexture') else material.get(key)
+        if info is not None:
+            yield key, info
+
+
+def _drop_textures(gltf, keep_image):
+    """Removes images for which keep_image(index) is false, and everything using them.
+
+    Returns the kept images' old indices, in their new order.
+    """
+    kept_images = [i for i in range(len(gltf.get('images', []))) if keep_image(i)]
+    image_map = {old: new for new, old in enumerate(kept_images)}
+    textures, texture_map = [], {}
+    for old, texture in enumerate(gltf.get('textures', [])):
+        if texture.get('source') in image_map:
+            texture['source'] = image_map[texture['source']]
+            texture_map[old] = len(textures)
+            textures.append(texture)
+    for material in gltf.get('materials', []):
+        pbr = material.get('pbrMetallicRoughness', {})
+        for key, info in list(_material_textures(material)):
+            owner = pbr if key in ('baseColorTexture', 'metallicRoughnessTexture') else material
+            if info['index'] in texture_map:
+                info['index'] = texture_map[info['index']]
+            else:
+                del owner[key]
+    gltf['images'] = [gltf['images'][i] for i in kept_images]
+    gltf['textures'] = textures
+    for key in ('images', 'textures', 'samplers'):
+        if not gltf.get(key):
+            gltf.pop(key, None)
+    return kept_images
+
+
+# --- Textures ---
+
+def image_size(path):
+    """(width, height) of a JPEG or PNG, read from its header."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return struct.unpack('>II', data[16:24])
+    if data[:2] == b'\xff\xd8':
+        i = 2
+        while i + 9 < len(data):
+            if data[i] != 0xFF:
+                i += 1
+                continue
+            marker = data[i + 1]
+            if marker == 0xFF: # Fill byte
+                i += 1
+                continue
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC): # Start of frame
+                height, width = struct.unpack('>HH', data[i + 5:i + 9])
+                return width, height
+            i += 2 + struct.unpack('>H', data[i + 2:i + 4])[0]
+    raise ValueError(f"{path}: not a JPEG or PNG image.")
+
+
+def fit_size(width, height, tier, multiple=4):
+    """Size that fits in tier x tier keeping the aspect ratio (never upscaled)."""
+    scale = min(1.0, tier / max(width, height))
+    return (max(multiple, round(width * scale / multiple) * multiple),
+            max(multiple, round(height * scale / multiple) * multiple))
+
+
+class KTX2Encoder:
+    """KTX2 via toktx: ETC1S for color and occlusion maps, UASTC for normal maps."""
+    name, extension, mime_type = 'ktx2', '.ktx2', 'image/ktx2'
+
+    def __init__(self, toktx='toktx'):
+        self.toktx = toktx
+
+    def encode(self, path, size, role):
+        if role == 'normal':
+            codec = ['--encode', 'uastc', '--uastc_quality', '2', '--zcmp', '18']
+        else:
+            codec = ['--encode', 'etc1s', '--clevel', '2', '--qlevel', '160']
+        oetf = 'srgb' if role == 'color' else 'linear'
+        with tempfile.TemporaryDirectory() as tmp:
+            out = os.path.join(tmp, 'texture.ktx2')
+            result = subprocess.run([self.toktx, '--t2', '--genmipmap', '--resize', f'{size[0]}x{size[1]}',
+                                     '--assign_oetf', oetf, *codec, out, path], capture_output=True, text=True)
+            if result.returncode != 0:
+                raise RuntimeError(f"toktx failed on {path}: {result.stderr.strip()}")
+            with open(out, 'rb') as f:
+                return f.read()
+
+
+class JPEGEncoder:
+    """Resized JPEGs via Pillow, for when toktx isn't installed."""
+    name, extension, mime_type = 'jpeg', '.jpg', 'image/jpeg'
+
+    def __init__(self, image_module):
+        self.Image = image_module
+
+    def encode(self, path, size, role):
+        import io
+        with self.Image.open(path) as image:
+            image = image.convert('RGB').resize(size, self.Image.LANCZOS)
+            out = io.BytesIO()
+            image.save(out, 'JPEG', quality=92 if role == 'normal' else 85, optimize=True)
+            return out.getvalue()
+
+
+def texture_encoder(kind='auto'):
+    """The encoder for `kind` ('auto', 'ktx2', 'jpeg'), or None for 'none'."""
+    if kind == 'none':
+        return None
+    toktx = shutil.which('toktx')
+    if kind in ('auto', 'ktx2') and toktx:
+        return KTX2Encoder(toktx)
+    if kind in ('auto', 'jpeg'):
+        try:
+            from PIL import Image
+            return JPEGEncoder(Image)
+        except ImportError:
+            pass
+    raise RuntimeError(f"No texture encoder for {kind!r}: install KTX-Software (toktx) or Pillow, "
+                       "or build without textures ('none').")
+
+
+# --- Build ---
+
+def _compress(data):
+    """Precompressed variants worth keeping: {encoding: bytes}."""
+    variants = {'gzip': gzip.compress(data, 9, mtime=0)}
+    if brotli is not None:
+        variants['br'] = brotli.compress(data, quality=11)
+    return {encoding: compressed for encoding, compressed in variants.items()
+            if len(compressed) <= len(data) * (1 - MIN_COMPRESSION_SAVING)}
+
+
+def _write_file(out_dir, name, data):
+    """Writes a file and its precompressed variants; returns its manifest entry."""
+    entry = {"file": name, "bytes": len(data), "encodings": {}}
+    with open(os.path.join(out_dir, name), 'wb') as f:
+        f.write(data)
+    variants = _compress(data)
+    for encoding, suffix in ENCODINGS:
+        if encoding in variants:
+            with open(os.path.join(out_dir, name + suffix), 'wb') as f:
+                f.write(variants[encoding])
+            entry["encodings"][encoding] = len(variants[encoding])
+    entry["transfer_bytes"] = min([len(data), *entry["encodings"].values()])
+    return entry
+
+
+def _glb(gltf, bin_data):
+    """A binary glTF (GLB) container for a JSON document and its one buffer."""
+    document = bytearray(json.dumps(gltf, separators=(',', ':')).encode('utf-8'))
+    _align(document, fill=b' ')
+    _align(bin_data)
+    length = 12 + 8 + len(document) + (8 + len(bin_data) if bin_data else 0)
+    out = bytearray(struct.pack('<4sII', b'glTF', 2, length))
+    out += struct.pack('<I4s', len(document), b'JSON') + document
+    if bin_data:
+        out += struct.pack('<I4s', len(bin_data), b'BIN\0') + bin_data
+    return bytes(out)
+
+
+def build(source, out_dir, tiers=DEFAULT_TIERS, textures='auto'):
+    """Builds the avatar from a .gltf into out_dir and returns the manifest.
+
+    `textures` is 'auto' (KTX2 if toktx is installed, else JPEG via Pillow),
+    'ktx2', 'jpeg' or 'none'. The smallest tier is embedded in the GLB.
+    """
+    tiers = sorted(set(tiers))
+    encoder = texture_encoder(textures)
+    source_dir = os.path.dirname(os.path.abspath(source))
+    with open(source, encoding='utf-8') as f:
+        gltf = json.load(f)
+    if len(gltf.get('buffers', [])) != 1:
+        raise ValueError("Expected exactly one buffer.")
+    buffer_path = os.path.join(source_dir, gltf['buffers'][0]['uri'])
+    with open(buffer_path, 'rb') as f:
+        bin_data = f.read()
+    source_files = [source, buffer_path]
+
+    convert_materials(gltf)
+    bin_out, needs_quantization = pack_geometry(gltf, bin_data)
+    if needs_quantization:
+        for key in ('extensionsUsed', 'extensionsRequired'):
+            gltf.setdefault(key, []).append('KHR_mesh_quantization')
+
+    image_paths = [os.path.join(source_dir, image.get('uri', '')) for image in gltf.get('images', [])]
+    for path in image_paths:
+        if not os.path.isfile(path):
+            print(f"Avatar: missing image {os.path.relpath(path, source_dir)}, dropped.")
+    kept = _drop_textures(gltf, lambda i: encoder is not None and os.path.isfile(image_paths[i]))
+    image_paths = [image_paths[i] for i in kept]
+    source_files.extend(image_paths)
+
+    roles = {} # image index -> 'color' | 'normal' | 'linear'
+    slots = {} # material name -> {three.js slot: image index}
+    for material in gltf.get('materials', []):
+        for key, info in _material_textures(material):
+            image = gltf['textures'][info['index']]['source']
+            roles.setdefault(image, 'color' if key in COLOR_TEXTURES else
+                             'normal' if key == 'normalTexture' else 'linear')
+            for slot in TEXTURE_SLOTS[key]:
+                slots.setdefault(material.get('name', ''), {})[slot] = image
+
+    os.makedirs(out_dir, exist_ok=True)
+    texture_entries = []
+    for image, path in enumerate(image_paths):
+        stem = os.path.splitext(os.path.basename(path))[0]
+        source_size = image_size(path)
+        entry = {"name": stem, "role": roles.get(image, 'color'), "source_size": list(source_size), "tiers": {}}
+        previous = None
+        for tier in tiers:
+            size = fit_size(*source_size, tier)
+            if previous and previous[0] == size: # Source is smaller than this tier
+                entry["tiers"][str(tier)] = previous[1]
+                continue
+            data = encoder.encode(path, size, entry["role"])
+            if tier == tiers[0]:
+                _align(bin_out)
+                gltf.setdefault('bufferViews', []).append(
+                    {"buffer": 0, "byteOffset": len(bin_out), "byteLength": len(data)})
+                bin_out.extend(data)
+                gltf['images'][image] = {"name": stem, "bufferView": len(gltf['bufferViews']) - 1,
+                                         "mimeType": encoder.mime_type}
+                tier_entry = {"embedded": True, "bytes": len(data), "size": list(size)}
+            else:
+                name = _content_name(f"{stem}.{tier}", data, encoder.extension)
+                tier_entry = dict(_write_file(out_dir, name, data), size=list(size))
+            entry["tiers"][str(tier)] = tier_entry
+            previous = (size, tier_entry)
+        texture_entries.append(entry)
+
+    if texture_entries and encoder.name == 'ktx2':
+        for texture in gltf['textures']:
+            texture['extensions'] = {"KHR_texture_basisu": {"source": texture.pop('source')}}
+        for key in ('extensionsUsed', 'extensionsRequired'):
+            gltf.setdefault(key, []).append('KHR_texture_basisu')
+
+    gltf['buffers'] = [{"byteLength": len(bin_out) + (-len(bin_out) % 4)}]
+    glb = _glb(gltf, bin_out)
+    model = _write_file(out_dir, _content_name(os.path.splitext(os.path.basename(source))[0], glb, '.glb'), glb)
+
+    tier_bytes = {}
+    for tier in tiers:
+        files = {model["file"]: model["transfer_bytes"]}
+        for entry in texture_entries:
+            tier_entry = entry["tiers"][str(tier)]
+            if not tier_entry.get("embedded"):
+                files[tier_entry["file"]] = tier_entry["transfer_bytes"]
+        tier_bytes[str(tier)] = sum(files.values())
+    manifest = {
+        "version": 1,
+        "model": model,
+        "texture_format": encoder.name if texture_entries else None,
+        "tiers": tiers if texture_entries else [],
+        "embedded_tier": tiers[0] if texture_entries else None,
+        "textures": texture_entries,
+        "materials": slots,
+        "source_bytes": sum(os.path.getsize(path) for path in source_files),
+        "first_render_bytes": model["transfer_bytes"],
+        "tier_bytes": tier_bytes if texture_entries else {},
+    }
+    _write_manifest(out_dir, manifest)
+    return manifest
+
+
+def manifest_files(manifest):
+    """{file name: precompressed encodings} for every file a build produced."""
+    files = {manifest["model"]["file"]: manifest["model"]["encodings"]}
+    for entry in manifest["textures"]:
+        for tier in entry["tiers"].values():
+            if not tier.get("embedded"):
+                files[tier["file"]] = tier["encodings"]
+    return files
+
+
+def _write_manifest(out_dir, manifest):
+    """Replaces the manifest atomically and removes files from builds before the previous one.
+
+    The previous build's files are listed under "previous_files" and stay
+    servable, as pages loaded before the rebuild still refer to them.
+    """
+    path = os.path.join(out_dir, MANIFEST_NAME)
+    current = manifest_files(manifest)
+    try:
+        with open(path, encoding='utf-8') as f:
+            previous = manifest_files(json.load(f))
+    except (OSError, ValueError, KeyError):
+        previous = {}
+    manifest["previous_files"] = {name: e for name, e in previous.items() if name not in current}
+    keep = set(current) | set(previous)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, path)
+    for name in os.listdir(out_dir):
+        base = name
+        for _, suffix in ENCODINGS:
+            if name.endswith(suffix):
+                base = name[:-len(suffix)]
+        if name != MANIFEST_NAME and os.path.splitext(base)[1] in MIME_TYPES and base not in keep:
+            os.remove(os.path.join(out_dir, name))
+
+
+def report(manifest):
+    """Lines describing the bytes saved, for the build command."""
+    source = manifest["source_bytes"]
+    mb = lambda n: f"{n / 1e6:.2f} MB"
+    saved = lambda n: f"{100 * (1 - n / source):.1f}% less" if source else ''
+    model = manifest["model"]
+    lines = [
+        f"Source (.gltf + .bin + images): {mb(source)}",
+        f"Model {model['file']}: {mb(model['bytes'])}, {mb(model['transfer_bytes'])} transferred",
+        f"First render: {mb(manifest['first_render_bytes'])} ({saved(manifest['first_render_bytes'])})",
+    ]
+    for tier, total in manifest["tier_bytes"].items():
+        lines.append(f"Tier {tier}: {mb(total)} in total ({saved(total)})")
+    return lines
+
+
+# --- Serving ---
+
+class AvatarAssets:
+    """Looks up built avatar files for /avatar, from the manifest in `directory`
+    (the current build's files and the previous build's).
+
+    The manifest is re-read when its mtime changes, so a rebuild is picked
+    up without restarting workers.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._manifest = None
+        self._files = {} # file name -> {encoding: size}
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        path = os.path.join(self.directory, MANIFEST_NAME)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime = None
+        with self._lock:
+            if mtime == self._mtime:
+                return self._manifest, self._files
+            manifest, files = None, {}
+            if mtime is not None:
+                try:
+                    with open(path, encoding='utf-8') as f:
+                        manifest = json.load(f)
+                    files = dict(manifest.pop("previous_files", {}), **manifest_files(manifest))
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"Avatar manifest unreadable, avatar disabled: {e}")
+                    manifest, files = None, {}
+            self._manifest, self._files, self._mtime = manifest, files, mtime
+            return manifest, files
+
+    def manifest(self, save_data=False):
+        """The manifest (None if not built). With save_data, only the embedded tier is offered."""
+        manifest, _ = self._load()
+        if manifest is None or not save_data or not manifest["tiers"]:
+            return manifest
+        smallest = str(manifest["embedded_tier"])
+        return dict(manifest, tiers=[manifest["embedded_tier"]],
+                    textures=[dict(t, tiers={smallest: t["tiers"][smallest]}) for t in manifest["textures"]],
+                    tier_bytes={smallest: manifest["tier_bytes"][smallest]})
+
+    def resolve(self, filename, accepts):
+        """(path, mimetype, content encoding or None) for a built file, or None.
+
+        `accepts(encoding)` says whether the client accepts a content encoding.
+        """
+        _, files = self._load()
+        encodings = files.get(filename)
+        if encodings is None:
+            return None
+        mimetype = MIME_TYPES.get(os.path.splitext(filename)[1], 'application/octet-stream')
+        for encoding, suffix in ENCODINGS:
+            path = os.path.join(self.directory, filename + suffix)
+            if encoding in encodings and accepts(encoding) and os.path.isfile(path):
+                return path, mimetype, encoding
+        path = os.path.join(self.directory, filename)
+        return (path, mimetype, None) if os.path.isfile(path) else None
@@ -0,0 +1,295 @@
+"""Pluggable LLM and TTS backends.
+
+The app talks to two small interfaces:
+
+    LLMBackend.create_model(model_name, system_instruction) -> model
+        model.generate(contents, timeout) -> reply text
+        model.stream(contents, timeout)   -> iterator of text chunks
+    TTSBackend.synthesize(text, lang, tld, slow, timeout) -> MP3 bytes
+
+plus, on both, validate() (config problems, no network), warm_up() (import
+and configure the client) and connect(timeout) (open the upstream channel).
+
+`GeminiLLMBackend` and `GTTSBackend` call the real services. Their client
+libraries are heavy (google.generativeai pulls in grpc, protobuf and
+google-api-core), so they are only imported on first use or by warm_up(),
+and import_client_libraries() lets a gunicorn master import them once for
+all workers. Constructing a backend never imports or configures anything,
+so the app can be imported without the libraries or an API key.
+
+`FakeLLMBackend` and `FakeTTSBackend` are local stand-ins with configurable
+latency, token rate, streaming and error rate, so the app can run and be
+load-tested without network access or an API key (LLM_BACKEND=fake,
+TTS_BACKEND=fake).
+"""
+import io
+import math
+import os
+import random
+import threading
+import time
+
+
+# --- Real backends ---
+class GeminiModel:
+    """A GenerativeModel that is only built (and genai imported) on first use."""
+
+    def __init__(self, backend, model_name, system_instruction=None):
+        self.backend = backend
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self._model = None
+
+    @property
+    def model(self):
+        if self._model is None:
+            # A concurrent first use may build two; both are equivalent and one is kept
+            self._model = self.backend.genai.GenerativeModel(
+                model_name=self.model_name, system_instruction=self.system_instruction)
+        return self._model
+
+    def prepare(self):
+        """Builds the underlying model now rather than on the first request."""
+        return self.model
+
+    def generate(self, contents, timeout=None):
+        return self.model.generate_content(contents, request_options={"timeout": timeout}).text
+
+    def stream(self, contents, timeout=None):
+        # generate_content(stream=True) already fetches the first chunk, so
+        # connection errors surface here (where they can be retried)
+        response = self.model.generate_content(contents, stream=True, request_options={"timeout": timeout})
+        return (chunk.text for chunk in response)
+
+
+class GeminiLLMBackend:
+    name = 'gemini'
+
+    @staticmethod
+    def import_client():
+        import google.generativeai as genai # Heavy (grpc, protobuf, google-api-core)
+        return genai
+
+    def __init__(self, api_key):
+        self.api_key = api_key
+        self._genai = None
+        self._lock = threading.Lock()
+
+    @property
+    def genai(self):
+        """The configured google.generativeai module, imported on first use."""
+        if self._genai is None:
+            with self._lock:
+                if self._genai is None:
+                    if not self.api_key:
+                        raise ValueError("GEMINI_API_KEY not found!")
+                    genai = self.import_client()
+                    genai.configure(api_key=self.api_key)
+                    self._genai = genai
+        return self._genai
+
+    def validate(self):
+        return [] if self.api_key else ["GEMINI_API_KEY not found (required with LLM_BACKEND=gemini)."]
+
+    def warm_up(self):
+        self.genai
+
+    def connect(self, model_name, timeout=None):
+        # Cheap metadata call (no tokens) that sets up the client's channel
+        self.genai.get_model(f"models/{model_name}", request_options={"timeout": timeout})
+
+    def create_model(self, model_name, system_instruction=None):
+        return GeminiModel(self, model_name, system_instruction)
+
+
+class GTTSBackend:
+    name = 'gtts'
+
+    @staticmethod
+    def import_client():
+        from gtts import gTTS
+        return gTTS
+
+    def __init__(self):
+        self._gTTS = None
+
+    @property
+    def gTTS(self):
+        if self._gTTS is None:
+            self._gTTS = self.import_client()
+        return self._gTTS
+
+    def validate(self):
+        return []
+
+    def warm_up(self):
+        self.gTTS
+
+    def connect(self, timeout=None):
+        pass # gTTS opens a new HTTP connection per request, there is no channel to open
+
+    def synthesize(self, text, lang, tld, slow=False, timeout=None):
+        tts = self.gTTS(text=text, lang=lang, tld=tld, slow=slow, timeout=timeout)
+        audio_fp = io.BytesIO()
+        tts.write_to_fp(audio_fp)
+        return audio_fp.getvalue()
+
+
+# --- Fake backends (offline benchmarking) ---
+class FakeUpstreamError(Exception):
+    """Injected failure; `code` makes it look like a retryable HTTP 503."""
+    code = 503
+
+
+class LatencyDistribution:
+    """Samples a delay in seconds: 'fixed', 'uniform' (median +/- jitter) or 'lognormal'."""
+
+    def __init__(self, median_ms, kind='lognormal', jitter=0.5):
+        self.median = median_ms / 1000
+        self.kind = kind
+        self.jitter = jitter # uniform: +/- fraction of the median; lognormal: sigma
+
+    def sample(self):
+        if self.kind == 'fixed' or self.median <= 0:
+            return max(self.median, 0)
+        if self.kind == 'uniform':
+            return self.median * random.uniform(1 - self.jitter, 1 + self.jitter)
+        return random.lognormvariate(math.log(self.median), self.jitter)
+
+    @classmethod
+    def from_env(cls, prefix, default_ms):
+        return cls(float(os.getenv(f'{prefix}_MS', default_ms)),
+                   kind=os.getenv(f'{prefix}_DIST', 'lognormal'),
+                   jitter=float(os.getenv(f'{prefix}_JITTER', 0.5)))
+
+
+WORDS = ('sir assist schedule project model data python report meeting reminder task '
+         'code review design deploy server latency cache voice answer today update plan').split()
+
+
+class FakeModel:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def _reply(self):
+        # Random words, so replies (and their TTS) don't all hit the caches
+        sentences = []
+        for _ in range(random.randint(*self.backend.sentences)):
+            words = random.choices(WORDS, k=random.randint(6, 16))
+            sentences.append(' '.join(words).capitalize() + '.')
+        return ' '.join(sentences)
+
+    def _maybe_fail(self):
+        if random.random() < self.backend.error_rate:
+            raise FakeUpstreamError("Injected fake LLM failure")
+
+    def generate(self, contents, timeout=None):
+        reply = self._reply()
+        time.sleep(self.backend.first_token.sample() + len(reply) / 4 / self.backend.tokens_per_sec)
+        self._maybe_fail()
+        return reply
+
+    def stream(self, contents, timeout=None):
+        reply = self._reply()
+        time.sleep(self.backend.first_token.sample())
+        self._maybe_fail()
+        return self._chunks(reply)
+
+    def _chunks(self, reply):
+        size = self.backend.chunk_chars
+        for i in range(0, len(reply), size):
+            chunk = reply[i:i + size]
+            time.sleep(len(chunk) / 4 / self.backend.tokens_per_sec) # ~4 chars per token
+            yield chunk
+
+
+class FakeBackendMixin:
+    """No client library, no configuration, nothing to connect to."""
+
+    def validate(self):
+        return []
+
+    def warm_up(self):
+        pass
+
+    def connect(self, *args, timeout=None):
+        pass
+
+
+class FakeLLMBackend(FakeBackendMixin):
+    name = 'fake'
+
+    def __init__(self, first_token=None, tokens_per_sec=None, chunk_chars=None,
+                 sentences=None, error_rate=None):
+        self.first_token = first_token or LatencyDistribution.from_env('FAKE_LLM_FIRST_TOKEN', 400)
+        self.tokens_per_sec = tokens_per_sec or float(os.getenv('FAKE_LLM_TOKENS_PER_SEC', 150))
+        self.chunk_chars = chunk_chars or int(os.getenv('FAKE_LLM_CHUNK_CHARS', 60))
+        self.sentences = sentences or (int(os.getenv('FAKE_LLM_MIN_SENTENCES', 2)),
+                                       int(os.getenv('FAKE_LLM_MAX_SENTENCES', 6)))
+        self.error_rate = float(os.getenv('FAKE_LLM_ERROR_RATE', 0)) if error_rate is None else error_rate
+
+    def create_model(self, model_name, system_instruction=None):
+        return FakeModel(self)
+
+
+# One silent MPEG-2 Layer III frame (32 kbps mono, 24 kHz, 24 ms - the same
+# format gTTS returns), so fake audio is a playable MP3 whose size and
+# duration scale with the text.
+SILENT_MP3_FRAME = b'\xff\xf3\x44\xc4' + b'\x00' * 92
+MP3_FRAME_SECONDS = 0.024
+CHARS_PER_SECOND_OF_SPEECH = 15
+
+
+class FakeTTSBackend(FakeBackendMixin):
+    name = 'fake'
+
+    def __init__(self, latency=None, ms_per_char=None, error_rate=None):
+        self.latency = latency or LatencyDistribution.from_env('FAKE_TTS_LATENCY', 250)
+        self.ms_per_char = float(os.getenv('FAKE_TTS_MS_PER_CHAR', 2)) if ms_per_char is None else ms_per_char
+        self.error_rate = float(os.getenv('FAKE_TTS_ERROR_RATE', 0)) if error_rate is None else error_rate
+
+    def synthesize(self, text, lang, tld, slow=False, timeout=None):
+        time.sleep(self.latency.sample() + len(text) * self.ms_per_char / 1000)
+        if random.random() < self.error_rate:
+            raise FakeUpstreamError("Injected fake TTS failure")
+        frames = max(1, round(len(text) / CHARS_PER_SECOND_OF_SPEECH / MP3_FRAME_SECONDS))
+        return SILENT_MP3_FRAME * frames
+
+
+LLM_BACKENDS = {'gemini': GeminiLLMBackend, 'fake': FakeLLMBackend}
+TTS_BACKENDS = {'gtts': GTTSBackend, 'fake': FakeTTSBackend}
+
+
+def _backend_kinds():
+    llm_kind = os.getenv('LLM_BACKEND', 'gemini')
+    tts_kind = os.getenv('TTS_BACKEND', 'gtts')
+    if llm_kind not in LLM_BACKENDS:
+        raise ValueError(f"Unknown LLM_BACKEND: {llm_kind}")
+    if tts_kind not in TTS_BACKENDS:
+        raise ValueError(f"Unknown TTS_BACKEND: {tts_kind}")
+    return llm_kind, tts_kind
+
+
+def import_client_libraries():
+    """Imports the configured backends' client libraries without configuring them.
+
+    Safe to call before forking (e.g. in a gunicorn master): it creates no
+    connections or threads, so workers inherit the imported modules for free.
+    """
+    llm_kind, tts_kind = _backend_kinds()
+    for backend_class in (LLM_BACKENDS[llm_kind], TTS_BACKENDS[tts_kind]):
+        if hasattr(backend_class, 'import_client'):
+            backend_class.import_client()
+
+
+def create_backends():
+    """Builds (llm_backend, tts_backend) from LLM_BACKEND / TTS_BACKEND."""
+    llm_kind, tts_kind = _backend_kinds()
+    if llm_kind == 'gemini':
+        llm_backend = GeminiLLMBackend(os.getenv('GEMINI_API_KEY'))
+    else:
+        llm_backend = LLM_BACKENDS[llm_kind]()
+    tts_backend = TTS_BACKENDS[tts_kind]()
+
+    print(f"Backends: LLM={llm_backend.name}, TTS={tts_backend.name}")
+    return llm_backend, tts_backend
@@ -0,0 +1,253 @@
+"""Offline load test for /chat and /chat/stream.
+
+By default the app is started in-process on a random port with the fake
+LLM and TTS backends (see backends.py) and a throwaway history/TTS cache
+directory, so no Google services or API key are needed:
+
+    python bench/loadtest.py --concurrency 1,8,32 --requests 100
+    python bench/loadtest.py --endpoint stream --pipeline-mode sync
+    FAKE_LLM_FIRST_TOKEN_MS=800 FAKE_TTS_ERROR_RATE=0.05 python bench/loadtest.py
+
+Or point it at a running server (e.g. gunicorn) and pass its master/worker
+pid so peak RSS can be read from /proc:
+
+    python bench/loadtest.py --url http://127.0.0.1:5000 --server-pid 12345
+
+For each endpoint and concurrency level it reports p50/p95/p99 latency,
+time to first byte, time to first audio byte, requests per second, errors
+and peak RSS. --json writes the same numbers to a file for comparison
+between runs.
+"""
+import argparse
+import http.client
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+QUERIES = [
+    "What can you do?",
+    "Remind me about the project meeting tomorrow.",
+    "Explain gradient descent in simple terms.",
+    "Give me three tips for writing clean Python.",
+    "Summarize what we talked about so far.",
+]
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile; None for an empty list."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, round(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def start_in_process_server(pipeline_mode):
+    """Imports the app with fake backends and serves it on a background thread."""
+    workdir = tempfile.mkdtemp(prefix='deva-bench-')
+    os.environ.setdefault('LLM_BACKEND', 'fake')
+    os.environ.setdefault('TTS_BACKEND', 'fake')
+    os.environ.setdefault('HISTORY_DB_PATH', os.path.join(workdir, 'history.sqlite3'))
+    os.environ.setdefault('TTS_CACHE_DIR', os.path.join(workdir, 'tts_cache'))
+    if pipeline_mode:
+        os.environ['PIPELINE_MODE'] = pipeline_mode
+    sys.path.insert(0, ROOT)
+
+    import logging
+    from werkzeug.serving import make_server
+    from app import app
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR) # No per-request access log
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", server
+
+
+def peak_rss_bytes(server_pid):
+    """Peak resident set size of the server (this process when running in-process)."""
+    if server_pid:
+        with open(f'/proc/{server_pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 # KiB on Linux
+
+
+class VirtualUser:
+    """One client connection with its own session cookie (its own conversation)."""
+
+    def __init__(self, base_url, character):
+        parts = urlsplit(base_url)
+        self.conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=120)
+        self.character = character
+        self.cookie = None
+
+    def _request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        self.conn.request(method, path, body=body, headers=headers)
+        response = self.conn.getresponse()
+        set_cookie = response.getheader('Set-Cookie')
+        if set_cookie:
+            self.cookie = set_cookie.split(';', 1)[0]
+        return response
+
+    def first_audio_byte(self, audio_url, start):
+        """Fetches the first byte of an audio URL; returns seconds since `start`."""
+        response = self._request('GET', audio_url, headers={'Range': 'bytes=0-0'})
+        response.read()
+        return time.perf_counter() - start if response.status in (200, 206) else None
+
+    def chat(self, query):
+        start = time.perf_counter()
+        response = self._request('POST', '/chat', {"query": query, "character": self.character})
+        first = response.read(1)
+        ttfb = time.perf_counter() - start
+        body = first + response.read()
+        latency = time.perf_counter() - start
+        if response.status != 200:
+            return {"ok": False, "status": response.status}
+        data = json.loads(body)
+        ttfa = self.first_audio_byte(data['audio_url'], start) if data.get('audio_url') else None
+        return {"ok": True, "latency": latency, "ttfb": ttfb, "ttfa": ttfa}
+
+    def stream(self, query):
+        start = time.perf_counter()
+        response = self._request('POST', '/chat/stream', {"query": query, "character": self.character})
+        if response.status != 200:
+            response.read()
+            return {"ok": False, "status": response.status}
+        ttfb = ttfa = None
+        first_audio_url = None
+        event = None
+        ok = True
+        while True:
+            line = response.readline()
+            if not line:
+                break
+            if ttfb is None:
+                ttfb = time.perf_counter() - start
+            line = line.decode('utf-8').rstrip('\n')
+            if line.startswith('event:'):
+                event = line[6:].strip()
+            elif line.startswith('data:'):
+                data = json.loads(line[5:])
+                if event == 'sentence' and data.get('audio_url') and first_audio_url is None:
+                    first_audio_url = data['audio_url']
+                    ttfa = time.perf_counter() - start # First playable chunk announced
+                elif event == 'error':
+                    ok = False
+        latency = time.perf_counter() - start
+        if first_audio_url:
+            # Count the audio fetch too; the browser has to download it before playing
+            ttfa = self.first_audio_byte(first_audio_url, time.perf_counter() - ttfa)
+        return {"ok": ok, "latency": latency, "ttfb": ttfb, "ttfa": ttfa}
+
+
+def run_level(base_url, endpoint, concurrency, total_requests, server_pid):
+    """Runs `total_requests` across `concurrency` virtual users; returns a result dict."""
+    results = []
+    lock = threading.Lock()
+    counter = iter(range(total_requests))
+
+    def worker(index):
+        user = VirtualUser(base_url, 'deva' if index % 2 == 0 else 'devi')
+        user._request('GET', '/').read() # Fresh session, like opening the page
+        call = user.stream if endpoint == 'stream' else user.chat
+        while True:
+            with lock:
+                n = next(counter, None)
+            if n is None:
+                return
+            try:
+                result = call(QUERIES[n % len(QUERIES)])
+            except Exception as e:
+                result = {"ok": False, "error": str(e)}
+                user = VirtualUser(base_url, user.character) # Connection is unusable now
+            with lock:
+                results.append(result)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    ok = [r for r in results if r["ok"]]
+    latencies = [r["latency"] for r in ok]
+    ttfbs = [r["ttfb"] for r in ok if r["ttfb"] is not None]
+    ttfas = [r["ttfa"] for r in ok if r["ttfa"] is not None]
+    ms = lambda v: round(v * 1000, 1) if v is not None else None
+    rss = peak_rss_bytes(server_pid)
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "rps": round(len(ok) / elapsed, 2),
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "ttfb_p50_ms": ms(percentile(ttfbs, 50)),
+        "ttfb_p95_ms": ms(percentile(ttfbs, 95)),
+        "ttfa_p50_ms": ms(percentile(ttfas, 50)),
+        "ttfa_p95_ms": ms(percentile(ttfas, 95)),
+        "peak_rss_mb": round(rss / 2**20, 1) if rss else None,
+    }
+
+
+COLUMNS = ["endpoint", "concurrency", "requests", "errors", "rps", "p50_ms", "p95_ms", "p99_ms",
+           "ttfb_p50_ms", "ttfb_p95_ms", "ttfa_p50_ms", "ttfa_p95_ms", "peak_rss_mb"]
+
+
+def print_table(rows):
+    widths = [max(len(c), *(len(str(r[c])) for r in rows)) for c in COLUMNS]
+    print('  '.join(c.rjust(w) for c, w in zip(COLUMNS, widths)))
+    for row in rows:
+        print('  '.join(str(row[c]).rjust(w) for c, w in zip(COLUMNS, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--url', help='Target a running server instead of starting one in-process.')
+    parser.add_argument('--server-pid', type=int, help='Read peak RSS of this pid (with --url).')
+    parser.add_argument('--endpoint', default='chat,stream', help='Comma list of: chat, stream.')
+    parser.add_argument('--concurrency', default='1,4,16', help='Comma list of concurrency levels.')
+    parser.add_argument('--requests', type=int, default=40, help='Requests per level.')
+    parser.add_argument('--pipeline-mode', choices=['sync', 'concurrent'],
+                        help='PIPELINE_MODE for the in-process server.')
+    parser.add_argument('--json', help='Also write results to this file.')
+    args = parser.parse_args()
+
+    base_url = args.url
+    if not base_url:
+        base_url, _ = start_in_process_server(args.pipeline_mode)
+
+    rows = []
+    for endpoint in args.endpoint.split(','):
+        for concurrency in (int(c) for c in args.concurrency.split(',')):
+            rows.append(run_level(base_url, endpoint.strip(), concurrency, args.requests, args.server_pid))
+            print(f"done: {endpoint} x{concurrency}", file=sys.stderr)
+
+    print_table(rows)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""Token-budgeted context window for Gemini chat requests.
+
+Only the most recent turns are sent verbatim, up to `token_budget` tokens.
+When a session grows past the budget, the oldest turns are folded into a
+rolling summary by a background thread; the summary is stored with the
+session (history_store.py) and sent in place of those turns from then on.
+
+Folding keeps only `keep_ratio` of the budget verbatim, so a summary is
+recomputed once every few turns rather than on every request, and never on
+the request path itself.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+CHARS_PER_TOKEN = 4 # Rough average for English text; good enough for budgeting
+
+SUMMARY_PREFIX = "Summary of our earlier conversation:\n"
+SUMMARY_ACK = "Understood. I'll keep that context in mind."
+
+
+def estimate_tokens(text):
+    """Cheap local token estimate (no network round trip to count_tokens)."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+class ContextWindow:
+    """Builds the history sent to the model and schedules summary folds."""
+
+    def __init__(self, summarize_fn, token_budget=2000, keep_ratio=0.5, max_workers=2):
+        # summarize_fn(previous_summary, [(role, text), ...]) -> new summary text
+        self.summarize_fn = summarize_fn
+        self.token_budget = token_budget
+        self.keep_ratio = keep_ratio
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='summarizer')
+        self._pending = set() # Session ids with a fold in flight in this process
+        self._lock = threading.Lock()
+
+    def build(self, history, system_instruction=''):
+        """Returns (contents, stats) for a SessionHistory whose last turn is the new user message.
+
+        `contents` is Gemini-format history: the rolling summary (if any)
+        followed by the recent turns that fit the token budget.
+        """
+        turns, summary, summary_seq, summarized_tokens = history.snapshot()
+        turn_tokens = [estimate_tokens(text) for _, _, text in turns]
+
+        # Walk back from the newest turn; the latest user message is always kept
+        keep_from = len(turns)
+        used = 0
+        for i in range(len(turns) - 1, -1, -1):
+            if keep_from < len(turns) and used + turn_tokens[i] > self.token_budget:
+                break
+            used += turn_tokens[i]
+            keep_from = i
+        # History sent to Gemini must start with a user turn
+        while keep_from < len(turns) - 1 and turns[keep_from][1] != 'user':
+            used -= turn_tokens[keep_from]
+            keep_from += 1
+
+        contents = []
+        if summary:
+            contents.append({"role": "user", "parts": [SUMMARY_PREFIX + summary]})
+            contents.append({"role": "model", "parts": [SUMMARY_ACK]})
+        contents.extend({"role": role, "parts": [text]} for _, role, text in turns[keep_from:])
+
+        if keep_from > 0:
+            self._schedule_fold(history, turns, turn_tokens, summary, summary_seq)
+
+        summary_tokens = estimate_tokens(summary) if summary else 0
+        system_tokens = estimate_tokens(system_instruction)
+        full_tokens = system_tokens + summarized_tokens + sum(turn_tokens)
+        sent_tokens = system_tokens + summary_tokens + used
+        stats = {
+            "prompt_tokens": sent_tokens,
+            "full_history_tokens": full_tokens,
+            "saved_tokens": max(full_tokens - sent_tokens, 0),
+            "summary_tokens": summary_tokens,
+            "verbatim_turns": len(turns) - keep_from,
+            "dropped_turns": keep_from, # Over budget, waiting to be folded into the summary
+        }
+        return contents, stats
+
+    def _schedule_fold(self, history, turns, turn_tokens, summary, summary_seq):
+        """Folds the oldest turns (down to keep_ratio of the budget) in the background."""
+        with self._lock:
+            if history.session_id in self._pending:
+                return
+            self._pending.add(history.session_id)
+
+        # Never fold the newest turn (the pending user message)
+        target = self.token_budget * self.keep_ratio
+        remaining = sum(turn_tokens)
+        fold_until = 0
+        while fold_until < len(turns) - 1 and (remaining > target or turns[fold_until][1] != 'user'):
+            remaining -= turn_tokens[fold_until]
+            fold_until += 1
+        folded = turns[:fold_until]
+        if not folded:
+            with self._lock:
+                self._pending.discard(history.session_id)
+            return
+
+        def fold():
+            try:
+                new_summary = self.summarize_fn(summary, [(role, text) for _, role, text in folded])
+                applied = history.fold(new_summary, folded[-1][0], summary_seq,
+                                       sum(turn_tokens[:fold_until]))
+                print(f"Context window: folded {len(folded)} turn(s) into summary "
+                      f"(applied={applied}).")
+            except Exception as e:
+                print(f"Error summarizing history: {e}")
+            finally:
+                with self._lock:
+                    self._pending.discard(history.session_id)
+
+        self._executor.submit(fold)
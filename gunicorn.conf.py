@@ -0,0 +1,30 @@
+# Gunicorn settings: gunicorn app:app (this file is picked up automatically).
+# Threaded workers let one process hold many in-flight conversations while
+# they wait on Gemini/gTTS; the speech pipeline bounds outbound TTS calls.
+import os
+
+bind = os.getenv('BIND', '0.0.0.0:5000')
+workers = int(os.getenv('WEB_CONCURRENCY', 2))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 16))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120)) # Long replies stream for a while
+
+# Import the app (and the heavy client libraries) once in the master; workers
+# are forked with them already loaded. Importing app.py opens no connections
+# and starts no threads, so this is fork-safe.
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() not in ('0', 'false', 'no')
+
+
+def on_starting(server):
+    import startup
+    startup.profile.start()
+    import backends
+    with startup.profile.phase('master:import_client_libraries'):
+        backends.import_client_libraries()
+
+
+def post_worker_init(worker):
+    # Runs in each worker after the app is loaded and before it accepts
+    # connections: configure clients, build models, prime caches
+    from app import warm_up
+    warm_up()
@@ -0,0 +1,378 @@
+"""Per-session conversation history shared across gunicorn workers.
+
+Each browser session gets its own history, kept in an in-process LRU cache
+(bounded by session count and total bytes) in front of a local SQLite
+database in WAL mode. Any worker process can serve any session: every cached
+session remembers the `generation` and `version` it loaded, and a single
+indexed lookup tells us whether another worker has changed it since. The
+version counts writes to a session row; the generation is a random id given
+to each new row, so a session that was cleared (or swept) and written to
+again never matches a copy cached before, even at the same version.
+
+Histories are capped per session (oldest turns are trimmed first) and whole
+sessions are deleted after `idle_ttl` seconds without activity. Each session
+can also carry a rolling summary of turns that were folded out of the
+verbatim history (see context_window.py).
+"""
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0,
+    next_seq INTEGER NOT NULL DEFAULT 0,
+    last_seen REAL NOT NULL,
+    summary TEXT NOT NULL DEFAULT '',
+    summary_seq INTEGER NOT NULL DEFAULT -1,
+    summarized_tokens INTEGER NOT NULL DEFAULT 0,
+    generation TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS turns (
+    session_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    text TEXT NOT NULL,
+    PRIMARY KEY (session_id, seq)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS sessions_last_seen ON sessions (last_seen);
+'''
+
+# Columns added after the first release of the schema: (name, definition)
+SESSION_COLUMNS = [
+    ('summary', "TEXT NOT NULL DEFAULT ''"),
+    ('summary_seq', 'INTEGER NOT NULL DEFAULT -1'),
+    ('summarized_tokens', 'INTEGER NOT NULL DEFAULT 0'),
+    ('generation', "TEXT NOT NULL DEFAULT ''"),
+]
+
+
+class _CachedSession:
+    """In-memory copy of one session: (seq, role, text) turns plus bookkeeping."""
+    __slots__ = ('turns', 'nbytes', 'generation', 'version', 'summary', 'summary_seq', 'summarized_tokens')
+
+    def __init__(self, turns, generation, version, summary='', summary_seq=-1, summarized_tokens=0):
+        self.turns = deque(turns)
+        self.nbytes = sum(len(text) for _, _, text in turns) + len(summary)
+        self.generation = generation
+        self.version = version
+        self.summary = summary
+        self.summary_seq = summary_seq
+        self.summarized_tokens = summarized_tokens
+
+
+class SessionHistoryStore:
+    """Session-keyed chat history: LRU memory front, SQLite (WAL) backend."""
+
+    def __init__(self, db_path, max_cached_sessions=500, max_memory_bytes=32 * 1024 * 1024,
+                 max_session_turns=100, max_session_bytes=256 * 1024,
+                 idle_ttl=24 * 60 * 60, sweep_interval=300):
+        self.db_path = db_path
+        self.max_cached_sessions = max_cached_sessions
+        self.max_memory_bytes = max_memory_bytes
+        self.max_session_turns = max_session_turns
+        self.max_session_bytes = max_session_bytes
+        self.idle_ttl = idle_ttl
+        self.sweep_interval = sweep_interval
+
+        self._cache = OrderedDict() # session_id -> _CachedSession, most recent last
+        self._cache_bytes = 0
+        self._lock = threading.RLock()
+        self._local = threading.local() # One SQLite connection per thread
+        self._last_sweep = time.time()
+
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+        self._db().executescript(SCHEMA)
+        self._migrate()
+        self.close() # Don't carry an open connection across a gunicorn --preload fork
+
+    # --- SQLite connection ---
+    def _db(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL') # Safe with WAL, avoids an fsync per append
+            conn.execute('PRAGMA busy_timeout=10000')
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        """Closes this thread's connection; the next call opens a new one."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _migrate(self):
+        db = self._db()
+        existing = {row[1] for row in db.execute('PRAGMA table_info(sessions)')}
+        for name, definition in SESSION_COLUMNS:
+            if name not in existing:
+                db.execute(f'ALTER TABLE sessions ADD COLUMN {name} {definition}')
+
+    # --- Memory cache helpers (call with self._lock held) ---
+    def _cache_put(self, session_id, cached):
+        self._cache_drop(session_id)
+        self._cache[session_id] = cached
+        self._cache_bytes += cached.nbytes
+        self._cache_enforce_limits()
+
+    def _cache_drop(self, session_id):
+        cached = self._cache.pop(session_id, None)
+        if cached is not None:
+            self._cache_bytes -= cached.nbytes
+
+    def _cache_enforce_limits(self):
+        # Evicting from memory only; the session stays in SQLite
+        while self._cache and (len(self._cache) > self.max_cached_sessions
+                               or self._cache_bytes > self.max_memory_bytes):
+            _, evicted = self._cache.popitem(last=False)
+            self._cache_bytes -= evicted.nbytes
+
+    def _load(self, session_id):
+        """Returns the cached session, reloading it if another worker changed it."""
+        db = self._db()
+        row = db.execute('SELECT generation, version FROM sessions WHERE session_id = ?',
+                         (session_id,)).fetchone()
+        generation, version = row if row else (None, 0)
+        cached = self._cache.get(session_id)
+        if cached is not None and (cached.generation, cached.version) == (generation, version):
+            self._cache.move_to_end(session_id)
+            return cached
+        summary_row = db.execute(
+            'SELECT summary, summary_seq, summarized_tokens FROM sessions WHERE session_id = ?', (session_id,)
+        ).fetchone() or ('', -1, 0)
+        turns = db.execute(
+            'SELECT seq, role, text FROM turns WHERE session_id = ? ORDER BY seq', (session_id,)
+        ).fetchall()
+        cached = _CachedSession(turns, generation, version, *summary_row)
+        self._cache_put(session_id, cached)
+        return cached
+
+    # --- Public API ---
+    def get(self, session_id):
+        """Returns the session history in Gemini format: [{"role", "parts": [text]}, ...]."""
+        with self._lock:
+            self._maybe_sweep()
+            cached = self._load(session_id)
+            return [{"role": role, "parts": [text]} for _, role, text in cached.turns]
+
+    def turn(self, session_id, index):
+        """Returns one turn (e.g. -1 for the latest) without copying the whole history."""
+        with self._lock:
+            _, role, text = self._load(session_id).turns[index]
+            return {"role": role, "parts": [text]}
+
+    def length(self, session_id):
+        """Number of turns in a session, without copying them."""
+        with self._lock:
+            return len(self._load(session_id).turns)
+
+    def append(self, session_id, role, text):
+        """Appends one turn. O(1) apart from trimming when the session is over its cap."""
+        now = time.time()
+        with self._lock:
+            self._maybe_sweep()
+            cached = self._load(session_id)
+            db = self._db()
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                db.execute(
+                    'INSERT INTO sessions (session_id, last_seen, generation) VALUES (?, ?, ?) '
+                    'ON CONFLICT(session_id) DO NOTHING', (session_id, now, uuid.uuid4().hex)
+                )
+                seq, generation, version = db.execute(
+                    'UPDATE sessions SET next_seq = next_seq + 1, version = version + 1, last_seen = ? '
+                    'WHERE session_id = ? RETURNING next_seq - 1, generation, version', (now, session_id)
+                ).fetchone()
+                db.execute('INSERT INTO turns (session_id, seq, role, text) VALUES (?, ?, ?, ?)',
+                           (session_id, seq, role, text))
+
+                if (cached.generation, cached.version) != (generation, version - 1):
+                    # Another worker wrote in between; rebuild from the database after commit
+                    cached = None
+                else:
+                    cached.turns.append((seq, role, text))
+                    cached.nbytes += len(text)
+                    self._cache_bytes += len(text)
+                    cached.generation, cached.version = generation, version
+                    self._trim(db, session_id, cached)
+                db.execute('COMMIT')
+            except Exception:
+                db.execute('ROLLBACK')
+                self._cache_drop(session_id)
+                raise
+            if cached is None:
+                self._cache_drop(session_id)
+            self._cache_enforce_limits()
+
+    def _trim(self, db, session_id, cached):
+        """Drops the oldest turns until the session fits its turn and byte caps."""
+        removed = 0
+        while cached.turns and (len(cached.turns) > self.max_session_turns
+                                or cached.nbytes > self.max_session_bytes):
+            self._pop_oldest(cached)
+            removed += 1
+        # Gemini expects history to start with a user turn
+        while cached.turns and removed and cached.turns[0][1] != 'user':
+            self._pop_oldest(cached)
+        if removed:
+            first_seq = cached.turns[0][0] if cached.turns else None
+            if first_seq is None:
+                db.execute('DELETE FROM turns WHERE session_id = ?', (session_id,))
+            else:
+                db.execute('DELETE FROM turns WHERE session_id = ? AND seq < ?', (session_id, first_seq))
+
+    def _pop_oldest(self, cached):
+        _, _, text = cached.turns.popleft()
+        cached.nbytes -= len(text)
+        self._cache_bytes -= len(text)
+
+    def pop(self, session_id):
+        """Removes and returns the most recent turn (used to roll back a failed request)."""
+        with self._lock:
+            cached = self._load(session_id)
+            if not cached.turns:
+                raise IndexError('pop from empty history')
+            seq, role, text = cached.turns[-1]
+            db = self._db()
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                db.execute('DELETE FROM turns WHERE session_id = ? AND seq = ?', (session_id, seq))
+                row = db.execute(
+                    'UPDATE sessions SET version = version + 1 WHERE session_id = ? RETURNING generation, version',
+                    (session_id,)).fetchone()
+                db.execute('COMMIT')
+            except Exception:
+                db.execute('ROLLBACK')
+                self._cache_drop(session_id)
+                raise
+            if row and (cached.generation, cached.version) == (row[0], row[1] - 1):
+                cached.turns.pop()
+                cached.nbytes -= len(text)
+                self._cache_bytes -= len(text)
+                cached.version = row[1]
+            else:
+                self._cache_drop(session_id) # Another worker wrote in between; reload on next access
+            return {"role": role, "parts": [text]}
+
+    def clear(self, session_id):
+        """Deletes one session's history (other sessions are untouched)."""
+        with self._lock:
+            db = self._db()
+            db.execute('DELETE FROM turns WHERE session_id = ?', (session_id,))
+            db.execute('DELETE FROM sessions WHERE session_id = ?', (session_id,))
+            self._cache_drop(session_id)
+
+    def snapshot(self, session_id):
+        """Returns (turns, summary, summary_seq, summarized_tokens) for one session,
+        where turns is a list of (seq, role, text) tuples."""
+        with self._lock:
+            cached = self._load(session_id)
+            return list(cached.turns), cached.summary, cached.summary_seq, cached.summarized_tokens
+
+    def fold(self, session_id, summary, upto_seq, expected_summary_seq, folded_tokens):
+        """Replaces turns up to `upto_seq` with `summary`.
+
+        Only applies if the stored summary still covers `expected_summary_seq`,
+        so two workers folding the same session can't both win. Returns True if
+        the fold was applied.
+        """
+        with self._lock:
+            db = self._db()
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                row = db.execute(
+                    'UPDATE sessions SET summary = ?, summary_seq = ?, '
+                    'summarized_tokens = summarized_tokens + ?, version = version + 1 '
+                    'WHERE session_id = ? AND summary_seq = ? RETURNING version',
+                    (summary, upto_seq, folded_tokens, session_id, expected_summary_seq)
+                ).fetchone()
+                if row:
+                    db.execute('DELETE FROM turns WHERE session_id = ? AND seq <= ?', (session_id, upto_seq))
+                db.execute('COMMIT')
+            except Exception:
+                db.execute('ROLLBACK')
+                raise
+            self._cache_drop(session_id) # Reloaded on next access
+            return row is not None
+
+    def session(self, session_id):
+        """Returns a list-like view of one session's history."""
+        return SessionHistory(self, session_id)
+
+    # --- Idle session eviction ---
+    def _maybe_sweep(self):
+        if time.time() - self._last_sweep >= self.sweep_interval:
+            self.sweep()
+
+    def sweep(self):
+        """Deletes sessions idle for longer than `idle_ttl`. Returns how many were removed."""
+        with self._lock:
+            self._last_sweep = time.time()
+            cutoff = self._last_sweep - self.idle_ttl
+            db = self._db()
+            expired = [row[0] for row in db.execute(
+                'SELECT session_id FROM sessions WHERE last_seen < ?', (cutoff,))]
+            if not expired:
+                return 0
+            db.execute('BEGIN IMMEDIATE')
+            for session_id in expired:
+                db.execute('DELETE FROM turns WHERE session_id = ?', (session_id,))
+                db.execute('DELETE FROM sessions WHERE session_id = ?', (session_id,))
+                self._cache_drop(session_id)
+            db.execute('COMMIT')
+            print(f"History store: evicted {len(expired)} idle session(s).")
+            return len(expired)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "cached_sessions": len(self._cache),
+                "cached_bytes": self._cache_bytes,
+                "stored_sessions": self._db().execute('SELECT COUNT(*) FROM sessions').fetchone()[0],
+            }
+
+
+class SessionHistory:
+    """List-like view over one session, so code written against the old global
+    `conversation_history` list (append, pop, indexing, slicing) keeps working."""
+
+    def __init__(self, store, session_id):
+        self.store = store
+        self.session_id = session_id
+
+    def append(self, turn):
+        self.store.append(self.session_id, turn["role"], turn["parts"][0])
+
+    def pop(self):
+        return self.store.pop(self.session_id)
+
+    def clear(self):
+        self.store.clear(self.session_id)
+
+    def snapshot(self):
+        return self.store.snapshot(self.session_id)
+
+    def fold(self, summary, upto_seq, expected_summary_seq, folded_tokens):
+        return self.store.fold(self.session_id, summary, upto_seq, expected_summary_seq, folded_tokens)
+
+    def __getitem__(self, index):
+        if isinstance(index, int):
+            return self.store.turn(self.session_id, index) # history[-1] etc. stay O(1)
+        return self.store.get(self.session_id)[index]
+
+    def __len__(self):
+        return self.store.length(self.session_id)
+
+    def __iter__(self):
+        return iter(self.store.get(self.session_id))
+
+    def __bool__(self):
+        return len(self) > 0
@@ -0,0 +1,241 @@
+"""Per-stage request timing, Server-Timing headers and Prometheus metrics.
+
+Each sampled request gets a `RequestMetrics` (kept on Flask's `g`) that
+times named stages (context, llm, clean, tts, json, ...) with
+`with request_metrics.stage('llm'):` and records per-reply values (reply
+length, audio bytes, history length). The app turns the stage timings into
+a `Server-Timing` header, so the breakdown shows up in the browser's
+network panel, and feeds them into histograms when the response is closed.
+Streamed responses therefore still count stages that ran after the headers
+went out, even though those can't appear in their header. A stage that runs
+several times (e.g. tts once per sentence) is summed, so with the concurrent
+pipeline stage totals can add up to more than the request's wall time.
+
+Exposition uses the Prometheus text format and is hand-rolled (counters,
+histograms and callback gauges) to avoid another dependency.
+
+Overhead: a stage costs two perf_counter() calls and a dict update
+(~1 us); the histogram updates run once per request after the response
+is sent. METRICS_SAMPLE_RATE < 1 skips timing for unsampled requests
+entirely. Request and error counters are always kept.
+"""
+import bisect
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+CHARS_BUCKETS = (50, 100, 200, 400, 800, 1600, 3200, 6400)
+BYTES_BUCKETS = (4096, 16384, 65536, 131072, 262144, 524288, 1048576, 4194304)
+TURNS_BUCKETS = (2, 4, 8, 16, 32, 64, 128)
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} counter'
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {} # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value) # First bucket with le >= value
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} histogram'
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series[:-1]):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [('le', bound)])
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _format_labels(self.labelnames, key)
+            yield f'{self.name}_sum{labels} {_format_value(series[-1])}'
+            yield f'{self.name}_count{labels} {cumulative}'
+
+
+class Gauge:
+    """Read at scrape time from `collect_fn()`, which returns [(labels dict, value), ...]."""
+
+    def __init__(self, name, help, collect_fn):
+        self.name, self.help, self.collect_fn = name, help, collect_fn
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} gauge'
+        for labels, value in self.collect_fn():
+            if value is None:
+                continue
+            yield f'{self.name}{_format_labels(labels.keys(), labels.values())} {_format_value(value)}'
+
+
+class RequestMetrics:
+    """Stage timings and per-reply values for one request."""
+
+    def __init__(self, endpoint, sampled):
+        self.endpoint = endpoint or 'unknown'
+        self.sampled = sampled
+        self.character = ''
+        self.start = time.perf_counter()
+        self.stages = {} # stage -> seconds (summed if a stage runs more than once)
+        self.values = {} # e.g. reply_chars, audio_bytes, history_turns
+        self._lock = threading.Lock() # TTS stages are recorded from pool threads
+
+    @contextmanager
+    def stage(self, name):
+        if not self.sampled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - start)
+
+    def iterate(self, iterable, name):
+        """Yields from `iterable`, timing only the waits for each item (and the first one
+        separately as `<name>_first`), so time spent by the consumer is not counted."""
+        iterator = iter(iterable)
+        first = True
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    if self.sampled:
+                        self.add_stage(name, time.perf_counter() - start)
+                    return
+                if self.sampled:
+                    elapsed = time.perf_counter() - start
+                    self.add_stage(name, elapsed)
+                    if first:
+                        self.add_stage(f'{name}_first', elapsed)
+                first = False
+                yield item
+        finally:
+            if hasattr(iterator, 'close'):
+                iterator.close() # Pass an early stop on to the wrapped generator
+
+    def add_stage(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def record(self, name, value):
+        with self._lock:
+            self.values[name] = self.values.get(name, 0) + value
+
+    def server_timing(self):
+        """Server-Timing header value: each stage so far plus the total, in milliseconds."""
+        with self._lock:
+            stages = list(self.stages.items())
+        stages.append(('total', time.perf_counter() - self.start))
+        return ', '.join(f'{name};dur={seconds * 1000:.1f}' for name, seconds in stages)
+
+
+class Metrics:
+    """The app's metrics: request/stage histograms, reply sizes and error counters."""
+
+    def __init__(self, enabled=True, sample_rate=1.0, server_timing=True):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.server_timing = server_timing
+        self._metrics = []
+
+        self.requests = self.add(Counter(
+            'deva_requests_total', 'Requests handled.', ['endpoint', 'character', 'status']))
+        self.errors = self.add(Counter(
+            'deva_errors_total', 'Errors by endpoint and kind.', ['endpoint', 'kind']))
+        self.request_seconds = self.add(Histogram(
+            'deva_request_seconds', 'Request latency, until the response is fully sent.',
+            ['endpoint', 'character']))
+        self.stage_seconds = self.add(Histogram(
+            'deva_stage_seconds', 'Time spent per request stage.', ['endpoint', 'stage', 'character']))
+        self.value_histograms = {
+            'reply_chars': self.add(Histogram(
+                'deva_reply_chars', 'Reply length in characters.', ['character'], CHARS_BUCKETS)),
+            'audio_bytes': self.add(Histogram(
+                'deva_audio_bytes', 'Audio bytes produced per reply.', ['character'], BYTES_BUCKETS)),
+            'speech_chars_removed': self.add(Histogram(
+                'deva_speech_chars_removed', 'Characters dropped from a reply before TTS.', ['character'],
+                CHARS_BUCKETS)),
+            'history_turns': self.add(Histogram(
+                'deva_history_turns', 'Conversation history length after the reply.', ['character'],
+                TURNS_BUCKETS)),
+        }
+
+    def add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def begin(self, endpoint):
+        """Starts tracking a request; returns None when metrics are disabled."""
+        if not self.enabled:
+            return None
+        return RequestMetrics(endpoint, random.random() < self.sample_rate)
+
+    def finish(self, request_metrics, status):
+        """Records a finished request (called once the response has been sent)."""
+        m = request_metrics
+        self.requests.inc(endpoint=m.endpoint, character=m.character, status=status)
+        if not m.sampled:
+            return
+        self.request_seconds.observe(time.perf_counter() - m.start, endpoint=m.endpoint, character=m.character)
+        for stage, seconds in m.stages.items():
+            self.stage_seconds.observe(seconds, endpoint=m.endpoint, stage=stage, character=m.character)
+        for name, value in m.values.items():
+            if name in self.value_histograms:
+                self.value_histograms[name].observe(value, character=m.character)
+
+    def error(self, kind, endpoint=None):
+        if self.enabled:
+            self.errors.inc(endpoint=endpoint or 'background', kind=kind)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
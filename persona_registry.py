@@ -0,0 +1,143 @@
+"""Persona registry: system prompts and long-lived Gemini models per character.
+
+Each persona is a pair of files in the personas/ directory:
+
+    personas/<name>.txt   - the system instruction, loaded once at startup
+    personas/<name>.json  - optional settings (display_name, model_name, tts_lang, tts_tld,
+                            prewarm_phrases, cacheable_queries)
+
+Dropping a new pair of files in that directory adds a character without code
+changes. Models are created once per (persona, model_name) and shared by all
+requests and threads, so the prompt string, the model object and its
+underlying client channel are all reused instead of rebuilt per request.
+"""
+import json
+import os
+import threading
+import time
+
+DEFAULT_SETTINGS = {
+    "model_name": "gemini-1.5-flash",
+    "tts_lang": "en",
+    "tts_tld": "com",
+}
+
+
+class Persona:
+    """One character: its system instruction plus model and voice settings."""
+
+    def __init__(self, name, system_instruction, display_name=None, model_name=None,
+                 tts_lang=None, tts_tld=None, prewarm_phrases=None, cacheable_queries=None):
+        self.name = name
+        self.system_instruction = system_instruction
+        self.display_name = display_name or name.capitalize()
+        self.model_name = model_name or DEFAULT_SETTINGS["model_name"]
+        self.tts_lang = tts_lang or DEFAULT_SETTINGS["tts_lang"]
+        self.tts_tld = tts_tld or DEFAULT_SETTINGS["tts_tld"]
+        # Fixed lines (greetings, ownership answer) worth having in the TTS cache up front
+        self.prewarm_phrases = prewarm_phrases or []
+        # Questions whose answer doesn't depend on the conversation (see response_cache.py)
+        self.cacheable_queries = cacheable_queries or []
+
+
+class _ModelEntry:
+    """A cached model plus its latency bookkeeping."""
+    __slots__ = ('model', 'init_ms', 'calls', 'first_call_ms', 'warm_total_ms')
+
+    def __init__(self, model, init_ms):
+        self.model = model
+        self.init_ms = init_ms
+        self.calls = 0
+        self.first_call_ms = None
+        self.warm_total_ms = 0.0
+
+
+class PersonaRegistry:
+    """Loads personas from a directory and hands out one shared model per persona."""
+
+    def __init__(self, persona_dir, model_factory, default='deva'):
+        # model_factory(model_name, system_instruction) -> model object
+        self.persona_dir = persona_dir
+        self.model_factory = model_factory
+        self.default = default
+        self.personas = {}
+        self._models = {} # (persona name, model_name) -> _ModelEntry
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """(Re)reads every persona in persona_dir."""
+        personas = {}
+        for filename in sorted(os.listdir(self.persona_dir)):
+            name, ext = os.path.splitext(filename)
+            if ext != '.txt':
+                continue
+            with open(os.path.join(self.persona_dir, filename), encoding='utf-8') as f:
+                system_instruction = f.read()
+            settings = {}
+            settings_path = os.path.join(self.persona_dir, name + '.json')
+            if os.path.exists(settings_path):
+                with open(settings_path, encoding='utf-8') as f:
+                    settings = json.load(f)
+            personas[name] = Persona(name, system_instruction, **settings)
+        if self.default not in personas:
+            raise ValueError(f"Default persona '{self.default}' not found in {self.persona_dir}")
+        self.personas = personas
+        print(f"Loaded personas: {', '.join(personas)}")
+
+    def get(self, name):
+        """Returns the named persona, falling back to the default one."""
+        return self.personas.get(name) or self.personas[self.default]
+
+    def model(self, name):
+        """Returns the shared model for a persona, creating it on first use."""
+        persona = self.get(name)
+        key = (persona.name, persona.model_name)
+        entry = self._models.get(key)
+        if entry is None:
+            with self._lock:
+                entry = self._models.get(key)
+                if entry is None:
+                    start = time.perf_counter()
+                    model = self.model_factory(persona.model_name, persona.system_instruction)
+                    if hasattr(model, 'prepare'):
+                        model.prepare() # Backends that build their client lazily do it now, timed
+                    entry = _ModelEntry(model, (time.perf_counter() - start) * 1000)
+                    self._models[key] = entry
+        return entry.model
+
+    def record_call(self, name, elapsed_ms):
+        """Records one upstream call so cold (first) and warm call latency can be compared."""
+        persona = self.get(name)
+        entry = self._models.get((persona.name, persona.model_name))
+        if entry is None:
+            return
+        with self._lock:
+            entry.calls += 1
+            if entry.first_call_ms is None:
+                entry.first_call_ms = elapsed_ms
+            else:
+                entry.warm_total_ms += elapsed_ms
+
+    def warm_up(self):
+        """Creates every persona's model ahead of the first request."""
+        for name in self.personas:
+            self.model(name)
+
+    def stats(self):
+        """Per-persona init and call latency, for the /personas route."""
+        stats = []
+        for name, persona in self.personas.items():
+            entry = self._models.get((name, persona.model_name))
+            warm_calls = entry.calls - 1 if entry and entry.calls > 1 else 0
+            stats.append({
+                "name": name,
+                "display_name": persona.display_name,
+                "model_name": persona.model_name,
+                "model_ready": entry is not None,
+                "init_ms": round(entry.init_ms, 2) if entry else None,
+                "calls": entry.calls if entry else 0,
+                "first_call_ms": round(entry.first_call_ms, 2) if entry and entry.first_call_ms is not None else None,
+                "warm_call_avg_ms": round(entry.warm_total_ms / warm_calls, 2) if warm_calls else None,
+            })
+        return stats
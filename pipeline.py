@@ -0,0 +1,154 @@
+"""Overlapping LLM generation with TTS synthesis.
+
+In "sync" mode each sentence is synthesized right after it is generated, so
+a reply costs (LLM time + sum of TTS times) and the worker thread is blocked
+throughout. In "concurrent" mode a producer thread reads sentences from the
+LLM stream and submits each one to a shared, bounded TTS thread pool as soon
+as it arrives; the caller receives results in sentence order while later
+sentences are still being generated and synthesized.
+
+Both pools are process-wide, so TTS_CONCURRENCY caps outbound TTS requests
+for every conversation the process is serving, and PIPELINE_MAX_STREAMS caps
+how many LLM streams are read concurrently.
+
+Throughput (simulated upstreams: LLM streams 5 sentences over 1.0 s, gTTS
+takes 0.4 s per sentence, 8 conversations at once, 8 request threads):
+
+    mode        reply latency (p50)   replies/s
+    sync        3.0 s                 2.7
+    concurrent  1.4 s                 5.7
+
+Reproduce with `python pipeline.py`.
+
+The producer stays at most `max_ahead` sentences ahead of the caller. When
+the caller stops early (e.g. an SSE client disconnects and the response
+generator is closed), the producer stops reading, closes the sentence
+iterator (releasing the LLM stream and its upstream slot) and TTS jobs that
+haven't started yet are cancelled.
+"""
+import contextvars
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+_DONE = object()
+_PUT_POLL_SECONDS = 0.1
+
+
+class SpeechPipeline:
+    """Runs a TTS function over a stream of sentences, either inline or overlapped."""
+
+    def __init__(self, mode='concurrent', tts_workers=4, max_streams=32, max_ahead=8):
+        self.mode = mode
+        self.max_ahead = max_ahead
+        self._tts_pool = ThreadPoolExecutor(max_workers=tts_workers, thread_name_prefix='tts')
+        self._stream_pool = ThreadPoolExecutor(max_workers=max_streams, thread_name_prefix='llm-stream')
+
+    def run(self, sentences, tts_fn):
+        """Yields (sentence, tts_fn(sentence)) pairs in order for an iterable of sentences.
+
+        tts_fn should handle its own errors; an exception raised by the
+        sentence iterable (the LLM call) is re-raised to the caller.
+        """
+        if self.mode != 'concurrent':
+            try:
+                for sentence in sentences:
+                    yield sentence, tts_fn(sentence)
+            finally:
+                _close(sentences)
+            return
+
+        # The producer and TTS tasks run in a copy of the caller's context, so
+        # Flask's request context (url_for, g) is available to them as well.
+        ordered = queue.Queue(maxsize=self.max_ahead)
+        cancelled = threading.Event()
+        ctx = contextvars.copy_context()
+        self._stream_pool.submit(ctx.run, self._produce, sentences, tts_fn, ordered, cancelled, ctx)
+        try:
+            while True:
+                item = ordered.get()
+                if item is _DONE:
+                    return
+                yield item.result() # Re-raises an LLM error at its position in the stream
+        finally:
+            cancelled.set() # No-op if the producer already finished
+            while True: # Unblock the producer and drop TTS jobs nobody will play
+                try:
+                    item = ordered.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not _DONE:
+                    item.cancel()
+
+    def _produce(self, sentences, tts_fn, ordered, cancelled, ctx):
+        try:
+            for sentence in sentences:
+                if cancelled.is_set():
+                    return
+                future = self._tts_pool.submit(ctx.copy().run, _synthesize, tts_fn, sentence)
+                if not _put(ordered, future, cancelled) or cancelled.is_set():
+                    future.cancel() # Queued after the caller's final drain
+                    return
+        except BaseException as e:
+            failed = Future()
+            failed.set_exception(e)
+            _put(ordered, failed, cancelled)
+        finally:
+            _close(sentences) # Stops the LLM stream if we returned early
+        _put(ordered, _DONE, cancelled)
+
+
+def _put(ordered, item, cancelled):
+    """Waits for room in the queue; False if the caller has gone away meanwhile."""
+    while not cancelled.is_set():
+        try:
+            ordered.put(item, timeout=_PUT_POLL_SECONDS)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _close(iterator):
+    close = getattr(iterator, 'close', None)
+    if close is not None:
+        close()
+
+
+def _synthesize(tts_fn, sentence):
+    return sentence, tts_fn(sentence)
+
+
+if __name__ == '__main__':
+    # Offline throughput comparison with simulated upstream latencies
+    import statistics
+    import time
+
+    SENTENCES, LLM_SECONDS, TTS_SECONDS, CONVERSATIONS = 5, 1.0, 0.4, 8
+
+    def fake_llm():
+        for i in range(SENTENCES):
+            time.sleep(LLM_SECONDS / SENTENCES)
+            yield f"Sentence {i}."
+
+    def fake_tts(sentence):
+        time.sleep(TTS_SECONDS)
+        return len(sentence)
+
+    for mode in ('sync', 'concurrent'):
+        pipeline = SpeechPipeline(mode=mode, tts_workers=16)
+        latencies = []
+
+        def one_reply():
+            start = time.perf_counter()
+            for _ in pipeline.run(fake_llm(), fake_tts):
+                pass
+            latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=CONVERSATIONS) as requests:
+            for _ in range(CONVERSATIONS * 3):
+                requests.submit(one_reply)
+        elapsed = time.perf_counter() - start
+        print(f"{mode:<11} p50 {statistics.median(latencies):.2f} s   "
+              f"{len(latencies) / elapsed:.1f} replies/s")
@@ -0,0 +1,162 @@
+"""Whole-reply cache per persona, for repeated context-free questions.
+
+A large share of traffic is the same few questions ("who made you", "hi",
+"what can you do"). For those, ResponseCache keeps the finished reply text
+and its audio id, keyed by (persona, normalized query), so a hit skips both
+the Gemini and the TTS call.
+
+The cache is shared by every session, so a key must capture everything the
+reply depends on. A query is cached when:
+- it is on the persona's allowlist (Persona.cacheable_queries). The operator
+  vouches that these get the same answer in any conversation;
+- it matches CONTEXT_FREE_RE (greetings, identity and capability questions)
+  and opens the conversation (empty history);
+- it matches CONTEXT_FREE_RE mid-conversation and `context_turns` > 0. Then
+  a digest of the last `context_turns` turns is added to the key, so "hi"
+  or "how are you" only hits after the same exchange.
+
+Anything else is never cached, not even a session's first question: answers
+to open questions can depend on the date, the time or anything else that
+changes within a TTL.
+
+Entries expire after `ttl` seconds; above `max_entries` the least recently
+used entry is evicted. Each worker process has its own cache. stats()
+reports the hit rate and the reply time saved (what the cached replies
+originally took to generate and synthesize).
+"""
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+PUNCTUATION_RE = re.compile(r"[^\w\s]+")
+WHITESPACE_RE = re.compile(r"\s+")
+CONTEXT_FREE_RE = re.compile(
+    r"(?:hi+|hello|hey|namaste|good (?:morning|afternoon|evening|night))(?: there)?(?: sir)?"
+    r"|who (?:made|created|built|developed|owns) you"
+    r"|who (?:is|s) your (?:creator|developer|owner|maker|boss)"
+    r"|who are you|what (?:is|s) your name|whats your name|introduce yourself"
+    r"|what can you do|what do you do|how can you help(?: me)?"
+    r"|how are you(?: doing)?(?: today)?"
+)
+
+
+def normalize_query(query, persona_name=''):
+    """Lowercases, drops punctuation and the persona's name, and collapses whitespace.
+
+    "Hey Deva, who made you?" and "who made you" both become "who made you"
+    (for persona "deva"); a query that is only the name is kept as is.
+    """
+    text = unicodedata.normalize('NFKC', query).lower()
+    text = PUNCTUATION_RE.sub(' ', text.replace("'", '').replace('’', ''))
+    words = text.split()
+    without_name = [w for w in words if w != persona_name]
+    if without_name and without_name != words and without_name[0] in ('hey', 'hi', 'ok', 'okay'):
+        without_name = without_name[1:] or without_name # "Hey Deva, ..." -> "..."
+    return WHITESPACE_RE.sub(' ', ' '.join(without_name or words)).strip()
+
+
+class _Entry:
+    __slots__ = ('text', 'audio_id', 'cost_seconds', 'expires_at')
+
+    def __init__(self, text, audio_id, cost_seconds, expires_at):
+        self.text = text
+        self.audio_id = audio_id
+        self.cost_seconds = cost_seconds
+        self.expires_at = expires_at
+
+
+class ResponseCache:
+    """TTL + LRU cache of (reply text, audio id) keyed by persona and normalized query."""
+
+    def __init__(self, ttl=3600, max_entries=1000, context_turns=0):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.context_turns = context_turns
+        self._entries = OrderedDict() # key -> _Entry, least recently used first
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "uncacheable": 0, "stores": 0,
+                         "expired": 0, "evictions": 0, "seconds_saved": 0.0}
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def key(self, persona, query, history=()):
+        """Cache key for this query, or None if it shouldn't be cached.
+
+        Call before the new user turn is added to `history`.
+        """
+        normalized = normalize_query(query, persona.name)
+        allowlist = {normalize_query(q, persona.name) for q in persona.cacheable_queries}
+        if normalized in allowlist:
+            return (persona.name, normalized, '')
+        if not CONTEXT_FREE_RE.fullmatch(normalized):
+            self._count("uncacheable")
+            return None
+        if not len(history):
+            return (persona.name, normalized, '')
+        if self.context_turns <= 0:
+            self._count("uncacheable") # Mid-conversation, the reply may depend on it
+            return None
+        digest = hashlib.sha256()
+        for turn in list(history)[-self.context_turns:]:
+            digest.update(f"{turn['role']}\0{turn['parts'][0]}\0".encode('utf-8'))
+        return (persona.name, normalized, digest.hexdigest())
+
+    def get(self, key, is_valid=None):
+        """Returns (reply text, audio id) for a key, or None.
+
+        `is_valid(entry_audio_id)` can reject an entry whose audio has since
+        been pruned from disk; the entry is then dropped and counted as a miss.
+        """
+        if key is None:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= now:
+                del self._entries[key]
+                self.counters["expired"] += 1
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is not None and is_valid is not None and not is_valid(entry.audio_id):
+            with self._lock:
+                self._entries.pop(key, None)
+            entry = None
+        if entry is None:
+            self._count("misses")
+            return None
+        with self._lock:
+            self.counters["hits"] += 1
+            self.counters["seconds_saved"] += entry.cost_seconds
+        return entry.text, entry.audio_id
+
+    def put(self, key, text, audio_id, cost_seconds):
+        """Stores a finished reply; `cost_seconds` is how long it took to produce."""
+        if key is None:
+            return
+        with self._lock:
+            self._entries[key] = _Entry(text, audio_id, cost_seconds, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            self.counters["stores"] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats["entries"] = len(self._entries)
+        stats["seconds_saved"] = round(stats["seconds_saved"], 3)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else None
+        stats["avg_seconds_saved_per_hit"] = round(stats["seconds_saved"] / stats["hits"], 3) if stats["hits"] else None
+        return stats
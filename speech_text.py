@@ -0,0 +1,129 @@
+"""Spoken form of a chat reply, for TTS.
+
+The chat bubble keeps the reply's markdown; what goes to TTS is a separate,
+plain spoken form:
+
+- fenced code blocks are replaced by a short note, inline code keeps its text;
+- links keep their label, and bare URLs are cut down to their host name;
+- headers, list markers, block quotes and table pipes are flattened, and
+  headers and list items get a full stop so the voice pauses after them;
+- emphasis markers, emoji and citation artifacts ("citeturn0search1",
+  "【4:0†source】", "[1]") are removed; an asterisk between two operands
+  ("3*4", "2 * x") is multiplication, not emphasis, and is read as "times".
+
+Less text means faster synthesis and smaller MP3s, and none of it read out
+as "asterisk asterisk" or "h t t p s colon slash slash".
+
+All patterns are compiled once at import. `to_speech()` converts a whole
+reply. `SpeechText.feed()` converts one streamed chunk at a time (e.g. the
+sentences from app.split_sentences) and remembers whether it is inside a
+code block; it also counts characters in and out per reply.
+"""
+import re
+
+CODE_NOTE = "I've put the code in the chat."
+
+FENCE = '```'
+FENCED_CODE_RE = re.compile(r'```.*?(?:```|\Z)', re.DOTALL) # An unclosed block runs to the end
+CITATION_RE = re.compile(
+    r'\ue200cite.*?\ue201|(?:cite)?(?:turn\d+[a-z]+\d+)+|\u3010[^\u3011]*\u3011|\[\^?\d+\]'
+)
+IMAGE_OR_LINK_RE = re.compile(r'!?\[([^\]]*)\]\([^)]*\)')
+URL_RE = re.compile(r'\b(?:https?://|www\.)(?:www\.)?([^/\s)\]>,]+)[^\s)\]>]*')
+INLINE_CODE_RE = re.compile(r'`([^`\n]*)`')
+# Operands are numbers, parentheses or single-letter variables ("2 * x", "(a+b)*c")
+TIMES_RE = re.compile(
+    r'(?<=[\d)]|(?<![^\W\d_])[a-zA-Z])\s*(\*\*?)\s*(?=[\d(]|[a-zA-Z](?![^\W\d_]))'
+)
+STAR_EMPHASIS_RE = re.compile(r'(\*{1,3}|~~)(?=\S)(.+?)(?<=\S)\1')
+UNDERSCORE_EMPHASIS_RE = re.compile(r'(?<!\w)(_{1,3})(?=\S)(.+?)(?<=\S)\1(?!\w)')
+STRAY_MARKUP_RE = re.compile(r'\*+|~~|`+')
+EMOJI_RE = re.compile(
+    '[\U0001F000-\U0001FAFF\u2300-\u23FF\u2600-\u27BF\u2B00-\u2BFF'
+    '\uFE00-\uFE0F\u200D\u20E3\U000E0020-\U000E007F]+'
+)
+
+HEADER_RE = re.compile(r'^\s{0,3}#{1,6}\s+')
+LIST_MARKER_RE = re.compile(r'^\s*(?:[-*+•▪◦‣➤]|\d{1,3}[.)])\s+')
+QUOTE_RE = re.compile(r'^\s*(?:>\s?)+')
+RULE_RE = re.compile(r'^\s*(?:[-*_]\s*){3,}$|^\s*\|?(?:\s*:?-{3,}:?\s*\|)+\s*:?-*:?\s*$')
+TABLE_PIPE_RE = re.compile(r'\s*\|\s*')
+
+SPACE_BEFORE_PUNCT_RE = re.compile(r'\s+([.,!?;:])')
+REPEATED_STOP_RE = re.compile(r'([.!?:;,])(?:\s+[.,])+')
+WHITESPACE_RE = re.compile(r'\s+')
+ENDS_WITH_PUNCT_RE = re.compile(r'[.!?:;,…]["”’)\]]*$')
+
+
+def _speak_line(line):
+    """Spoken form of one line that is not inside a code block."""
+    if RULE_RE.match(line):
+        return ''
+    structural = False # Header/list item/table row: end it with a pause
+    for pattern in (HEADER_RE, LIST_MARKER_RE, QUOTE_RE):
+        line, n = pattern.subn('', line, count=1)
+        structural = structural or bool(n)
+    if '|' in line and line.strip().startswith('|'):
+        line = TABLE_PIPE_RE.sub(', ', line).strip(' ,')
+        structural = True
+
+    line = CITATION_RE.sub('', line)
+    line = IMAGE_OR_LINK_RE.sub(r'\1', line)
+    line = URL_RE.sub(r'\1', line)
+    line = INLINE_CODE_RE.sub(r'\1', line)
+    line = TIMES_RE.sub(lambda m: ' times ' if m.group(1) == '*' else ' to the power of ', line)
+    line = STAR_EMPHASIS_RE.sub(r'\2', line)
+    line = UNDERSCORE_EMPHASIS_RE.sub(r'\2', line)
+    line = STRAY_MARKUP_RE.sub('', line)
+    line = EMOJI_RE.sub('', line).strip()
+
+    if structural and line and not ENDS_WITH_PUNCT_RE.search(line):
+        line += '.'
+    return line
+
+
+def _speak(text):
+    text = FENCED_CODE_RE.sub(f'\n{CODE_NOTE}\n', text)
+    spoken = ' '.join(filter(None, (_speak_line(line) for line in text.split('\n'))))
+    spoken = SPACE_BEFORE_PUNCT_RE.sub(r'\1', spoken)
+    spoken = REPEATED_STOP_RE.sub(r'\1', spoken)
+    spoken = WHITESPACE_RE.sub(' ', spoken).strip()
+    return '' if not any(c.isalnum() for c in spoken) else spoken
+
+
+def to_speech(text):
+    """Spoken form of a whole reply ('' if nothing in it is worth saying)."""
+    return _speak(text)
+
+
+class SpeechText:
+    """Converts a reply to its spoken form chunk by chunk, in order.
+
+    Keeps track of open code blocks across chunks, so a block split over
+    several streamed sentences is replaced by a single note.
+    """
+
+    def __init__(self):
+        self.in_code = False
+        self.chars_in = 0
+        self.chars_out = 0
+
+    def feed(self, chunk):
+        """Spoken form of the next chunk ('' if it has nothing to say)."""
+        self.chars_in += len(chunk)
+        text = chunk
+        if self.in_code:
+            end = text.find(FENCE)
+            if end < 0:
+                return '' # Still inside the code block
+            text = text[end + len(FENCE):]
+            self.in_code = False
+        if text.count(FENCE) % 2:
+            self.in_code = True # Opened here, closed in a later chunk
+        spoken = _speak(text)
+        self.chars_out += len(spoken)
+        return spoken
+
+    @property
+    def chars_removed(self):
+        return self.chars_in - self.chars_out
@@ -0,0 +1,170 @@
+"""Start-up profiling for app workers.
+
+`profile` records, per process:
+
+- import time per module, measured by an import hook that app.py (and the
+  gunicorn master, see gunicorn.conf.py) installs before anything else is
+  imported. Both cumulative time (including the module's own imports) and
+  self time are kept;
+- named start-up phases (creating backends, warm-up steps, ...);
+- time from process start (for a gunicorn worker, its fork) to ready.
+
+A forked worker inherits what its master recorded, so modules imported in
+the master show up with the master's pid. report() is served at /startup
+and printed by `flask --app app check-config`. The import hook is removed
+once the process is ready, so imports made while serving requests aren't
+wrapped. Set STARTUP_PROFILE=false to skip it altogether.
+"""
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+class _TimedLoader:
+    """Wraps a module's loader to time create_module + exec_module."""
+
+    def __init__(self, loader, timer):
+        self._loader = loader
+        self._timer = timer
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+    def create_module(self, spec):
+        create = getattr(self._loader, 'create_module', None)
+        if create is None:
+            return None
+        with self._timer.measure(spec.name): # Extension modules do their work here
+            return create(spec)
+
+    def exec_module(self, module):
+        try:
+            with self._timer.measure(module.__name__):
+                self._loader.exec_module(module)
+        finally:
+            # Hand the real loader back so nothing keeps seeing the wrapper
+            module.__loader__ = self._loader
+            if getattr(module, '__spec__', None) is not None:
+                module.__spec__.loader = self._loader
+
+
+class ImportTimer:
+    """A sys.meta_path hook that times every module imported while installed."""
+
+    def __init__(self):
+        self.modules = {} # name -> {"cumulative": s, "self": s, "top_level": bool, "pid": pid}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def install(self):
+        if self not in sys.meta_path:
+            sys.meta_path.insert(0, self)
+
+    def uninstall(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def find_spec(self, name, path, target=None):
+        if getattr(self._local, 'finding', False):
+            return None # A finder below us is importing something itself
+        self._local.finding = True
+        try:
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, 'find_spec'):
+                    continue
+                spec = finder.find_spec(name, path, target)
+                if spec is not None:
+                    break
+            else:
+                return None
+        finally:
+            self._local.finding = False
+        # Loaders that only implement the legacy load_module() are left alone
+        if hasattr(spec.loader, 'exec_module') and not isinstance(spec.loader, _TimedLoader):
+            spec.loader = _TimedLoader(spec.loader, self)
+        return spec
+
+    @contextmanager
+    def measure(self, name):
+        stack = self._local.__dict__.setdefault('stack', [])
+        frame = [0.0] # Time spent in nested imports
+        stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            stack.pop()
+            if stack:
+                stack[-1][0] += elapsed
+            with self._lock:
+                entry = self.modules.setdefault(name, {"cumulative": 0.0, "self": 0.0,
+                                                       "top_level": not stack, "pid": os.getpid()})
+                entry["cumulative"] += elapsed
+                entry["self"] += elapsed - frame[0]
+
+
+def _process_age():
+    """Seconds since this process started (Linux; None elsewhere)."""
+    try:
+        with open('/proc/self/stat') as f:
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class StartupProfile:
+    def __init__(self):
+        self.imports = ImportTimer()
+        self.phases = [] # (name, seconds, pid)
+        self.ready = None # {"pid", "seconds_since_process_start"}
+
+    def start(self):
+        """Installs the import hook, unless STARTUP_PROFILE is off."""
+        if os.getenv('STARTUP_PROFILE', 'true').lower() not in ('0', 'false', 'no'):
+            self.imports.install()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start, os.getpid()))
+
+    def mark_ready(self):
+        """Records that this process has finished starting up and removes the import hook."""
+        self.imports.uninstall()
+        self.ready = {"pid": os.getpid(), "seconds_since_process_start": _process_age()}
+        age = self.ready["seconds_since_process_start"]
+        print(f"Worker {os.getpid()} ready" + (f" {age:.2f}s after start." if age is not None else "."))
+
+    def report(self, top=15):
+        with self.imports._lock:
+            modules = dict(self.imports.modules)
+        ms = lambda seconds: round(seconds * 1000, 2)
+        by_cumulative = sorted(((name, e) for name, e in modules.items() if e["top_level"]),
+                               key=lambda item: -item[1]["cumulative"])
+        by_self = sorted(modules.items(), key=lambda item: -item[1]["self"])
+        return {
+            "pid": os.getpid(),
+            "ready": self.ready,
+            "phases": [{"name": name, "ms": ms(seconds), "pid": pid} for name, seconds, pid in self.phases],
+            "import_total_ms": ms(sum(e["cumulative"] for _, e in by_cumulative)),
+            "modules_imported": len(modules),
+            "slowest_imports": [
+                {"module": name, "cumulative_ms": ms(e["cumulative"]), "pid": e["pid"]}
+                for name, e in by_cumulative[:top]
+            ],
+            "slowest_modules_self": [
+                {"module": name, "self_ms": ms(e["self"]), "pid": e["pid"]} for name, e in by_self[:top]
+            ],
+        }
+
+
+profile = StartupProfile()
@@ -0,0 +1,108 @@
+"""SessionHistoryStore across workers: two stores (one per process) sharing one database."""
+import pytest
+
+from history_store import SessionHistoryStore
+
+SESSION = 'a' * 32
+
+
+@pytest.fixture
+def stores(tmp_path):
+    path = str(tmp_path / 'history.sqlite3')
+    return SessionHistoryStore(path), SessionHistoryStore(path)
+
+
+def texts(store, session_id=SESSION):
+    return [turn["parts"][0] for turn in store.get(session_id)]
+
+
+def test_append_is_seen_by_other_store(stores):
+    a, b = stores
+    a.append(SESSION, 'user', 'hi')
+    assert texts(b) == ['hi'] # b caches it now
+    a.append(SESSION, 'model', 'hello')
+    assert texts(b) == ['hi', 'hello']
+    b.append(SESSION, 'user', 'how are you')
+    assert texts(a) == ['hi', 'hello', 'how are you']
+
+
+def test_clear_then_new_turns_on_other_store(stores):
+    a, b = stores
+    a.append(SESSION, 'user', 'my PIN is 4321')
+    a.append(SESSION, 'model', 'noted')
+    assert texts(a) == ['my PIN is 4321', 'noted']
+
+    b.clear(SESSION)
+    b.append(SESSION, 'user', 'hi')
+    b.append(SESSION, 'model', 'hello')
+    # Same number of writes as before the clear: a must not take its old copy as current
+    assert texts(a) == ['hi', 'hello']
+    a.append(SESSION, 'user', 'thanks')
+    assert texts(b) == ['hi', 'hello', 'thanks']
+
+
+def test_clear_is_seen_by_other_store(stores):
+    a, b = stores
+    a.append(SESSION, 'user', 'hi')
+    assert texts(a) == ['hi']
+    b.clear(SESSION)
+    assert texts(a) == []
+    assert len(a.session(SESSION)) == 0
+
+
+def test_sweep_then_new_turns_on_other_store(stores):
+    a, b = stores
+    a.append(SESSION, 'user', 'old question')
+    assert texts(a) == ['old question']
+    b.idle_ttl = -1 # Everything counts as idle
+    assert b.sweep() == 1
+    b.idle_ttl = 24 * 60 * 60
+    b.append(SESSION, 'user', 'new question')
+    assert texts(a) == ['new question']
+
+
+def test_pop_is_seen_by_other_store(stores):
+    a, b = stores
+    a.append(SESSION, 'user', 'hi')
+    a.append(SESSION, 'model', 'hello')
+    assert texts(b) == ['hi', 'hello']
+    assert a.pop(SESSION)["parts"] == ['hello']
+    assert texts(b) == ['hi']
+    b.append(SESSION, 'model', 'hey')
+    assert texts(a) == ['hi', 'hey']
+
+
+def test_fold_is_seen_by_other_store(stores):
+    a, b = stores
+    for i in range(4):
+        a.append(SESSION, 'user' if i % 2 == 0 else 'model', f'turn {i}')
+    turns, summary, summary_seq, _ = b.snapshot(SESSION)
+    assert b.fold(SESSION, 'summary of turn 0-1', turns[1][0], summary_seq, 10)
+    turns, summary, _, tokens = a.snapshot(SESSION)
+    assert [text for _, _, text in turns] == ['turn 2', 'turn 3']
+    assert (summary, tokens) == ('summary of turn 0-1', 10)
+    # A second fold against the old summary state is rejected
+    assert not a.fold(SESSION, 'stale', turns[0][0], summary_seq, 5)
+
+
+def test_trim_is_seen_by_other_store(tmp_path):
+    path = str(tmp_path / 'history.sqlite3')
+    a = SessionHistoryStore(path, max_session_turns=4)
+    b = SessionHistoryStore(path, max_session_turns=4)
+    for i in range(4):
+        a.append(SESSION, 'user' if i % 2 == 0 else 'model', f'turn {i}')
+    assert len(texts(b)) == 4
+    a.append(SESSION, 'user', 'turn 4')
+    a.append(SESSION, 'model', 'turn 5')
+    assert texts(b) == ['turn 2', 'turn 3', 'turn 4', 'turn 5']
+    assert b.session(SESSION)[-1]["parts"] == ['turn 5']
+
+
+def test_clear_keeps_other_sessions(stores):
+    a, b = stores
+    other = 'b' * 32
+    a.append(SESSION, 'user', 'mine')
+    a.append(other, 'user', 'theirs')
+    b.clear(SESSION)
+    assert texts(a) == []
+    assert texts(a, other) == ['theirs']
@@ -0,0 +1,25 @@
+"""to_speech: markdown emphasis is dropped, multiplication is read out."""
+import pytest
+
+from speech_text import to_speech
+
+
+@pytest.mark.parametrize('text, spoken', [
+    ('3*4*5 = 60', '3 times 4 times 5 = 60'),
+    ('2 * 3', '2 times 3'),
+    ('5 * (2+3)', '5 times (2+3)'),
+    ('2 * x = 10', '2 times x = 10'),
+    ('2**3 is 8', '2 to the power of 3 is 8'),
+])
+def test_multiplication_is_read_out(text, spoken):
+    assert to_speech(text) == spoken
+
+
+@pytest.mark.parametrize('text, spoken', [
+    ('**bold** and *it*', 'bold and it'),
+    ('Total: **5** items', 'Total: 5 items'),
+    ('This is *a* dog', 'This is a dog'),
+    ('* item one', 'item one.'),
+])
+def test_emphasis_and_list_stars_are_dropped(text, spoken):
+    assert to_speech(text) == spoken
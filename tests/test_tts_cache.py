@@ -0,0 +1,39 @@
+"""TTSCache disk tier: hits keep their files, pruning drops the least recently used."""
+import os
+
+from tts_cache import TTSCache
+
+
+def synthesize(text, lang, tld, slow):
+    return text.encode() * 100
+
+
+def age(cache, key):
+    os.utime(cache._path(key), (1, 1))
+
+
+def test_memory_and_disk_hits_refresh_mtime(tmp_path):
+    a = TTSCache(str(tmp_path), synthesize, touch_interval=0)
+    key, _ = a.get_or_synthesize('hello', 'en', 'com')
+    age(a, key)
+    a.get_or_synthesize('hello', 'en', 'com') # Memory hit
+    assert os.stat(a._path(key)).st_mtime > 1
+
+    b = TTSCache(str(tmp_path), synthesize) # Another worker: disk hit
+    age(a, key)
+    b.get_or_synthesize('hello', 'en', 'com')
+    assert os.stat(a._path(key)).st_mtime > 1
+
+
+def test_prune_keeps_recently_used(tmp_path):
+    cache = TTSCache(str(tmp_path), synthesize, max_disk_bytes=1000, prune_every=10 ** 6, touch_interval=0)
+    hot, _ = cache.get_or_synthesize('hot', 'en', 'com') # 300 bytes
+    cold, _ = cache.get_or_synthesize('cold', 'en', 'com') # 400 bytes
+    new, _ = cache.get_or_synthesize('newer', 'en', 'com') # 500 bytes
+    age(cache, hot)
+    age(cache, cold)
+    cache.get_or_synthesize('hot', 'en', 'com')
+    cache.prune_disk()
+    assert os.path.exists(cache._path(hot))
+    assert os.path.exists(cache._path(new))
+    assert not os.path.exists(cache._path(cold))
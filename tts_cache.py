@@ -0,0 +1,300 @@
+"""Content-addressed cache for synthesized speech (MP3 bytes).
+
+Entries are keyed by a SHA-256 of (normalized text, lang, tld, slow) and kept
+in two tiers:
+
+- a byte-bounded in-memory LRU per worker process, and
+- an on-disk directory (<cache_dir>/<key[:2]>/<key>.mp3) that survives
+  restarts and is shared by every worker. Files are written to a temp file
+  and renamed into place, so concurrent workers never see partial files.
+
+Replies are cached per sentence: a reply's audio is the concatenation of its
+sentences' MP3s (which is also how gTTS joins its own internal chunks), so a
+sentence repeated inside otherwise different replies is only synthesized once.
+
+The disk tier is pruned oldest-mtime-first, and every hit refreshes the
+entry's mtime, so the least recently used files go first. Pruning walks the
+whole directory, so it runs on a background thread rather than in the
+request whose write triggered it.
+
+Every disk entry doubles as a servable audio file: `synthesize_to_id` returns
+an id that `audio_path` resolves to an MP3 on disk, which the /audio/<id>
+route streams to the browser.
+"""
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+def normalize_text(text):
+    """Canonical form used for cache keys: NFC, single spaces, trimmed."""
+    return ' '.join(unicodedata.normalize('NFC', text).split())
+
+
+AUDIO_ID_RE = re.compile(r'[0-9a-f]{64}')
+
+
+def cache_key(text, lang, tld, slow=False):
+    raw = '\x1f'.join([normalize_text(text), lang, tld, '1' if slow else '0'])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class TTSCache:
+    """Memory LRU + disk cache in front of a synthesize function."""
+
+    def __init__(self, cache_dir, synthesize_fn, split_fn=None,
+                 max_memory_bytes=16 * 1024 * 1024, max_disk_bytes=512 * 1024 * 1024,
+                 prune_every=200, touch_interval=60.0):
+        # synthesize_fn(text, lang, tld, slow) -> MP3 bytes
+        # split_fn(text) -> list of sentences (None caches whole texts only)
+        self.cache_dir = cache_dir
+        self.synthesize_fn = synthesize_fn
+        self.split_fn = split_fn
+        self.max_memory_bytes = max_memory_bytes
+        self.max_entry_bytes = max_memory_bytes // 4 # Don't let one entry flush the LRU
+        self.max_disk_bytes = max_disk_bytes
+        self.prune_every = prune_every
+        self.touch_interval = touch_interval # Min seconds between mtime refreshes of a memory hit
+
+        self._memory = OrderedDict() # key -> bytes, most recent last
+        self._memory_bytes = 0
+        self._touched = {} # key -> monotonic time its file's mtime was last refreshed
+        self._lock = threading.Lock()
+        self._disk_writes = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='tts-prune')
+        self._prune_pending = False
+        self.counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+            "bytes_saved": 0, # Audio bytes served from cache instead of synthesized
+            "synth_seconds": 0.0, # Time spent in synthesize_fn on misses
+        }
+        os.makedirs(cache_dir, exist_ok=True)
+
+    # --- Tiers ---
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.mp3')
+
+    def _memory_get(self, key):
+        with self._lock:
+            audio = self._memory.get(key)
+            if audio is not None:
+                self._memory.move_to_end(key)
+            return audio
+
+    def _memory_put(self, key, audio):
+        if len(audio) > self.max_entry_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                return
+            self._memory[key] = audio
+            self._memory_bytes += len(audio)
+            while self._memory_bytes > self.max_memory_bytes:
+                evicted_key, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+                self._touched.pop(evicted_key, None)
+                self.counters["memory_evictions"] += 1
+
+    def _disk_get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _disk_put(self, key, audio):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(audio)
+            os.replace(tmp_path, path) # Atomic: readers see the old file or the whole new one
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        with self._lock:
+            self._disk_writes += 1
+            should_prune = self._disk_writes % self.prune_every == 0 and not self._prune_pending
+            if should_prune:
+                self._prune_pending = True
+        if should_prune:
+            self._executor.submit(self._prune_in_background)
+
+    def _prune_in_background(self):
+        try:
+            self.prune_disk()
+        except Exception as e:
+            print(f"TTS cache prune failed: {e}")
+        finally:
+            with self._lock:
+                self._prune_pending = False
+
+    def prune_disk(self):
+        """Deletes least recently used files (by mtime) until the disk tier fits max_disk_bytes."""
+        if not self.max_disk_bytes:
+            return
+        files = []
+        total = 0
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if not name.endswith('.mp3'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        files.sort()
+        for _, size, path in files:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            with self._lock:
+                self.counters["disk_evictions"] += 1
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    # --- Public API ---
+    def get_or_synthesize(self, text, lang, tld, slow=False):
+        """Returns (key, MP3 bytes) for one piece of text, synthesizing on a miss."""
+        key = cache_key(text, lang, tld, slow)
+        audio = self._memory_get(key)
+        if audio is not None:
+            self._count("memory_hits")
+            self._count("bytes_saved", len(audio))
+            self._refresh(key)
+            return key, audio
+        audio = self._disk_get(key)
+        if audio is not None:
+            self._count("disk_hits")
+            self._count("bytes_saved", len(audio))
+            self._memory_put(key, audio)
+            self._refresh(key)
+            return key, audio
+
+        self._count("misses")
+        start = time.perf_counter()
+        audio = self.synthesize_fn(normalize_text(text), lang, tld, slow)
+        self._count("synth_seconds", time.perf_counter() - start)
+        self._disk_put(key, audio)
+        self._memory_put(key, audio)
+        return key, audio
+
+    def synthesize(self, text, lang, tld, slow=False):
+        """Returns MP3 bytes for a whole reply, cached sentence by sentence."""
+        sentences = self.split_fn(text) if self.split_fn else [text]
+        return b''.join(self.get_or_synthesize(sentence, lang, tld, slow)[1]
+                        for sentence in sentences if sentence.strip())
+
+    def synthesize_to_id(self, text, lang, tld, slow=False):
+        """Returns the id of an on-disk MP3 for a whole reply (see audio_path).
+
+        Single-sentence replies reuse the sentence entry; longer replies get a
+        composite file keyed by their sentence keys, written once.
+        """
+        return self.compose_texts([text], lang, tld, slow)
+
+    def compose_texts(self, texts, lang, tld, slow=False):
+        """Like synthesize_to_id, for several texts played back to back.
+
+        Each text is split and cached exactly as synthesize_to_id(text) would,
+        so texts synthesized one by one earlier are all cache hits here.
+        """
+        parts = []
+        for text in texts:
+            sentences = self.split_fn(text) if self.split_fn else [text]
+            parts.extend(self.get_or_synthesize(sentence, lang, tld, slow)
+                         for sentence in sentences if sentence.strip())
+        return self.compose(parts)
+
+    def compose(self, parts):
+        """Returns the audio id for a sequence of (key, MP3 bytes) sentence parts."""
+        if not parts:
+            return None
+        if len(parts) == 1:
+            audio_id, audio = parts[0]
+        else:
+            audio_id = hashlib.sha256('+'.join(key for key, _ in parts).encode('ascii')).hexdigest()
+            audio = None
+        if not self._touch(audio_id):
+            # New composite, or a memory-only entry whose file was pruned
+            self._disk_put(audio_id, audio if audio is not None else b''.join(a for _, a in parts))
+        return audio_id
+
+    def _touch(self, key):
+        """Marks a disk entry as recently used (pruning is by mtime). False if missing."""
+        try:
+            os.utime(self._path(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _refresh(self, key):
+        """Touches a hit's file so pruning keeps it, at most once per touch_interval."""
+        now = time.monotonic()
+        with self._lock:
+            last = self._touched.get(key)
+            if last is not None and now - last < self.touch_interval:
+                return
+            if key in self._memory:
+                self._touched[key] = now # Only tracked while the entry is in memory
+        self._touch(key)
+
+    def audio_path(self, audio_id):
+        """Returns the MP3 path for an audio id, or None if unknown/expired."""
+        if not AUDIO_ID_RE.fullmatch(audio_id or ''):
+            return None
+        path = self._path(audio_id)
+        return path if os.path.exists(path) else None
+
+    def prewarm(self, phrases, lang, tld, slow=False):
+        """Synthesizes and stores a list of known phrases. Returns how many were new."""
+        misses_before = self.counters["misses"]
+        for phrase in phrases:
+            if phrase.strip():
+                self.synthesize(phrase, lang, tld, slow)
+        return self.counters["misses"] - misses_before
+
+    def load(self, phrases, lang, tld, slow=False):
+        """Copies already-synthesized phrases from disk into memory, without
+        synthesizing anything. Returns how many sentences were loaded."""
+        loaded = 0
+        for phrase in phrases:
+            sentences = self.split_fn(phrase) if self.split_fn else [phrase]
+            for sentence in sentences:
+                key = cache_key(sentence, lang, tld, slow)
+                audio = self._disk_get(key) if sentence.strip() else None
+                if audio is not None:
+                    self._memory_put(key, audio)
+                    loaded += 1
+        return loaded
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats["synth_seconds"] = round(stats["synth_seconds"], 3)
+            stats["memory_entries"] = len(self._memory)
+            stats["memory_bytes"] = self._memory_bytes
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 4) if lookups else None
+        return stats
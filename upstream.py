@@ -0,0 +1,272 @@
+"""Guarded calls to upstream services (Gemini, gTTS).
+
+Every upstream gets an `Upstream` wrapper that provides:
+
+- a concurrency semaphore, plus admission control: once `max_waiting` calls
+  are queued for a slot, new calls are rejected with UpstreamBusy (HTTP 429)
+  instead of queueing forever;
+- a deadline per call; each attempt is given the time that is left, and
+  `fn(timeout)` is expected to pass it on to the client library. A call
+  that runs out of time raises UpstreamTimeout (HTTP 503 with Retry-After);
+- retries with exponential backoff and full jitter, for errors the
+  `is_retryable` predicate accepts;
+- a circuit breaker that opens after `failure_threshold` consecutive
+  failures and rejects calls with UpstreamUnavailable (HTTP 503) until
+  `reset_timeout` has passed, then lets one trial call through.
+
+`status()` exposes breaker state, in-flight and queued calls and counters.
+"""
+import math
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+
+class UpstreamError(Exception):
+    """Base class for errors raised by the guard itself (not by the upstream)."""
+    status_code = 503
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class UpstreamUnavailable(UpstreamError):
+    """Circuit open: the upstream is failing, so we fail fast."""
+    status_code = 503
+
+
+class UpstreamBusy(UpstreamError):
+    """Too many calls already waiting for this upstream."""
+    status_code = 429
+
+
+class UpstreamTimeout(UpstreamError):
+    """The call's deadline passed before it could complete.
+
+    Served as 503 with a Retry-After hint like the other rejections: the
+    client should back off and retry, not treat it as a gateway failure.
+    """
+    status_code = 503
+
+
+class CircuitBreaker:
+    """Closed -> open after N consecutive failures -> half-open after a cool-down."""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Returns (allowed, retry_after seconds)."""
+        with self._lock:
+            if self.state == 'closed':
+                return True, None
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if self.state == 'open' and remaining <= 0:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self._trial_in_flight:
+                self._trial_in_flight = True # Let exactly one trial call through
+                return True, None
+            return False, max(remaining, 1.0)
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.consecutive_failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == 'half_open' or self.consecutive_failures >= self.failure_threshold:
+                if self.state != 'open':
+                    print(f"Circuit breaker opened after {self.consecutive_failures} failure(s).")
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def release_trial(self):
+        """Frees the half-open trial slot when a call ends without a verdict."""
+        with self._lock:
+            self._trial_in_flight = False
+
+
+class Upstream:
+    """Concurrency limit, admission control, deadlines, retries and a breaker for one upstream."""
+
+    def __init__(self, name, max_concurrency=8, max_waiting=32, timeout=30.0, retries=2,
+                 backoff_base=0.25, backoff_max=4.0, failure_threshold=5, reset_timeout=30.0,
+                 is_retryable=lambda e: False, is_timeout=lambda e: isinstance(e, TimeoutError)):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.is_retryable = is_retryable
+        self.is_timeout = is_timeout
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.waiting = 0
+        self._avg_call_seconds = 1.0 # EWMA, used for Retry-After hints
+        self.counters = {"calls": 0, "failures": 0, "retries": 0, "rejected": 0, "timeouts": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    # --- Admission ---
+    def check_admission(self):
+        """Raises UpstreamUnavailable/UpstreamBusy if a call would be rejected right now."""
+        if self.breaker.state == 'open':
+            remaining = self.breaker.opened_at + self.breaker.reset_timeout - time.monotonic()
+            if remaining > 0:
+                self._count("rejected")
+                raise UpstreamUnavailable(f"{self.name} is temporarily unavailable", retry_after=remaining)
+        if self.waiting >= self.max_waiting:
+            self._count("rejected")
+            raise UpstreamBusy(f"{self.name} is busy", retry_after=self._queue_retry_after())
+
+    def _queue_retry_after(self):
+        return max(1.0, self._avg_call_seconds * (self.waiting + 1) / self.max_concurrency)
+
+    def _timed_out(self):
+        self._count("timeouts")
+        return UpstreamTimeout(f"{self.name} call timed out", retry_after=self._queue_retry_after())
+
+    @contextmanager
+    def _slot(self, deadline):
+        self.check_admission()
+        with self._lock:
+            self.waiting += 1
+        try:
+            acquired = self._slots.acquire(timeout=max(deadline - time.monotonic(), 0))
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        if not acquired:
+            self._count("rejected")
+            raise UpstreamBusy(f"{self.name} is busy", retry_after=self._queue_retry_after())
+        with self._lock:
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+
+    # --- Attempts ---
+    def _attempt(self, fn, deadline):
+        """Runs fn(timeout) with retries, updating the breaker after each attempt."""
+        attempt = 0
+        while True:
+            allowed, retry_after = self.breaker.allow()
+            if not allowed:
+                self._count("rejected")
+                raise UpstreamUnavailable(f"{self.name} is temporarily unavailable", retry_after=retry_after)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.breaker.release_trial()
+                raise self._timed_out()
+
+            self._count("calls")
+            start = time.monotonic()
+            try:
+                result = fn(remaining)
+            except Exception as e:
+                retryable = self.is_retryable(e)
+                self._count("failures")
+                if retryable:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.release_trial() # The caller's fault, not the upstream's
+                backoff = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+                backoff = random.uniform(0, backoff) # Full jitter
+                if not retryable or attempt >= self.retries or time.monotonic() + backoff >= deadline:
+                    # Out of attempts or time: a client timeout, or a transient error past
+                    # the deadline, is reported as our own timeout (503 + Retry-After)
+                    if self.is_timeout(e) or (retryable and time.monotonic() >= deadline):
+                        raise self._timed_out() from e
+                    raise
+                attempt += 1
+                self._count("retries")
+                print(f"Retrying {self.name} in {backoff:.2f}s after error: {e}")
+                time.sleep(backoff)
+                continue
+
+            elapsed = time.monotonic() - start
+            with self._lock:
+                self._avg_call_seconds = 0.8 * self._avg_call_seconds + 0.2 * elapsed
+            return result
+
+    # --- Public API ---
+    def call(self, fn, timeout=None):
+        """Calls fn(timeout_seconds) under the concurrency limit, deadline, retries and breaker."""
+        deadline = time.monotonic() + (timeout or self.timeout)
+        with self._slot(deadline):
+            result = self._attempt(fn, deadline)
+        self.breaker.record_success()
+        return result
+
+    def stream(self, fn, timeout=None):
+        """Like call(), for a fn that returns an iterator.
+
+        Opening the stream is retried; the slot is held until the stream is
+        fully consumed, and a failure mid-stream counts against the breaker.
+        The deadline covers the whole stream: it is checked as each chunk
+        arrives, so a trickling stream can't hold its slot indefinitely.
+        """
+        deadline = time.monotonic() + (timeout or self.timeout)
+        with self._slot(deadline):
+            iterator = self._attempt(fn, deadline)
+            try:
+                for chunk in iterator:
+                    if time.monotonic() >= deadline:
+                        raise TimeoutError(f"{self.name} stream passed its deadline")
+                    yield chunk
+            except Exception as e:
+                if isinstance(e, TimeoutError) or self.is_retryable(e):
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.release_trial()
+                close = getattr(iterator, 'close', None)
+                if close is not None:
+                    close()
+                if isinstance(e, TimeoutError) or self.is_timeout(e):
+                    raise self._timed_out() from e
+                raise
+            except GeneratorExit: # Consumer stopped early (e.g. client disconnected)
+                self.breaker.release_trial()
+                raise
+        self.breaker.record_success()
+
+    def status(self):
+        with self._lock:
+            return {
+                "name": self.name,
+                "breaker": self.breaker.state,
+                "consecutive_failures": self.breaker.consecutive_failures,
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "max_concurrency": self.max_concurrency,
+                "max_waiting": self.max_waiting,
+                "avg_call_seconds": round(self._avg_call_seconds, 3),
+                **self.counters,
+            }
+
+
+def retry_after_header(seconds):
+    """Formats a Retry-After value (whole seconds, at least 1)."""
+    return str(max(1, math.ceil(seconds or 1)))